@@ -0,0 +1,78 @@
+"""add natural key indexes to person and source
+
+Revision ID: 5c2e8d41f7b9
+Revises: a8b91e46d518
+Create Date: 2026-10-18 14:02:37.518204
+
+"""
+from typing import Sequence
+from typing import Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "5c2e8d41f7b9"
+down_revision: Union[str, None] = "a8b91e46d518"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def merge_duplicates(table, key, references):
+    """Repoint `references` of duplicate rows to the first one and drop the rest."""
+    duplicates = f"""
+        SELECT id, first_value(id) OVER (PARTITION BY {key} ORDER BY id) AS keep
+        FROM {table}
+    """
+    for ref_table, ref_column in references:
+        if ref_table == "sourceauthorlink":
+            # the link is a primary key, merging may make it a duplicate too
+            other = "person_id" if ref_column == "source_id" else "source_id"
+            op.execute(
+                f"""
+                INSERT INTO sourceauthorlink ({ref_column}, {other})
+                SELECT d.keep, l.{other}
+                FROM sourceauthorlink l JOIN ({duplicates}) d ON l.{ref_column} = d.id
+                WHERE d.id <> d.keep
+                ON CONFLICT DO NOTHING
+                """
+            )
+            op.execute(
+                f"""
+                DELETE FROM sourceauthorlink l USING ({duplicates}) d
+                WHERE l.{ref_column} = d.id AND d.id <> d.keep
+                """
+            )
+        else:
+            op.execute(
+                f"""
+                UPDATE {ref_table} SET {ref_column} = d.keep FROM ({duplicates}) d
+                WHERE {ref_table}.{ref_column} = d.id AND d.id <> d.keep
+                """
+            )
+    op.execute(
+        f"""
+        DELETE FROM {table} t USING ({duplicates}) d
+        WHERE t.id = d.id AND d.id <> d.keep
+        """
+    )
+
+
+def upgrade() -> None:
+    merge_duplicates(
+        "person",
+        "name, surname",
+        [("song", "recorded_by_id"), ("sourceauthorlink", "person_id")],
+    )
+    merge_duplicates(
+        "source", "title", [("song", "source_id"), ("sourceauthorlink", "source_id")]
+    )
+    op.create_index(
+        "ix_person_name_surname", "person", ["name", "surname"], unique=True
+    )
+    op.create_index("ix_source_title", "source", ["title"], unique=True)
+
+
+def downgrade() -> None:
+    op.drop_index("ix_source_title", table_name="source")
+    op.drop_index("ix_person_name_surname", table_name="person")
@@ -0,0 +1,38 @@
+"""add song listing order index
+
+Revision ID: 7e1b4c90a3d2
+Revises: d3f6a2c9b184
+Create Date: 2026-10-18 20:05:41.337016
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "7e1b4c90a3d2"
+down_revision: Union[str, None] = "d3f6a2c9b184"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # keyset pagination of source listings, see app.songs.pagination
+    op.create_index(
+        "ix_song_source_order",
+        "song",
+        [
+            "source_id",
+            sa.text("coalesce(signature, '')"),
+            sa.text("coalesce(page, -1)"),
+            sa.text("coalesce(number, -1)"),
+            "id",
+        ],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_song_source_order", table_name="song")
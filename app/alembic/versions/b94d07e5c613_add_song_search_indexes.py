@@ -0,0 +1,123 @@
+"""add song search indexes
+
+Revision ID: b94d07e5c613
+Revises: 7e1b4c90a3d2
+Create Date: 2026-10-18 20:41:09.552873
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = "b94d07e5c613"
+down_revision: Union[str, None] = "7e1b4c90a3d2"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS unaccent")
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    # unaccent() is only STABLE, its dictionary could change, so it can't be
+    # indexed. Pinning the dictionary makes an IMMUTABLE wrapper safe to use.
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION f_unaccent(text) RETURNS text
+        LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT
+        AS $$ SELECT public.unaccent('public.unaccent'::regdictionary, $1) $$
+        """
+    )
+
+    op.add_column("song", sa.Column("search_vector", postgresql.TSVECTOR()))
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION song_search_vector_update() RETURNS trigger
+        LANGUAGE plpgsql
+        AS $$
+        DECLARE
+            recorder text;
+        BEGIN
+            SELECT name || ' ' || surname INTO recorder
+            FROM person WHERE id = NEW.recorded_by_id;
+            NEW.search_vector :=
+                setweight(to_tsvector('simple', f_unaccent(coalesce(NEW.title, ''))), 'A')
+                || setweight(to_tsvector('simple', f_unaccent(coalesce(NEW.location, ''))), 'B')
+                || setweight(to_tsvector('simple', f_unaccent(coalesce(recorder, ''))), 'B')
+                || setweight(to_tsvector('simple', f_unaccent(coalesce(NEW.verses, ''))), 'C');
+            RETURN NEW;
+        END
+        $$
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER song_search_vector_update
+        BEFORE INSERT OR UPDATE OF title, location, verses, recorded_by_id ON song
+        FOR EACH ROW EXECUTE FUNCTION song_search_vector_update()
+        """
+    )
+    # renaming a person updates the songs they recorded
+    op.execute(
+        """
+        CREATE OR REPLACE FUNCTION person_search_vector_update() RETURNS trigger
+        LANGUAGE plpgsql
+        AS $$
+        BEGIN
+            UPDATE song SET recorded_by_id = recorded_by_id
+            WHERE recorded_by_id = NEW.id;
+            RETURN NULL;
+        END
+        $$
+        """
+    )
+    op.execute(
+        """
+        CREATE TRIGGER person_search_vector_update
+        AFTER UPDATE OF name, surname ON person
+        FOR EACH ROW EXECUTE FUNCTION person_search_vector_update()
+        """
+    )
+    op.execute("UPDATE song SET title = title")
+
+    op.create_index(
+        "ix_song_search_vector", "song", ["search_vector"], postgresql_using="gin"
+    )
+    op.create_index(
+        "ix_song_title_trgm",
+        "song",
+        [sa.text("f_unaccent(title) gin_trgm_ops")],
+        postgresql_using="gin",
+    )
+    op.create_index(
+        "ix_song_location_trgm",
+        "song",
+        [sa.text("f_unaccent(location) gin_trgm_ops")],
+        postgresql_using="gin",
+    )
+    op.create_index(
+        "ix_person_full_name_trgm",
+        "person",
+        [sa.text("f_unaccent(name || ' ' || surname) gin_trgm_ops")],
+        postgresql_using="gin",
+    )
+    op.create_index("ix_song_recorded_by_id", "song", ["recorded_by_id"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_song_recorded_by_id", table_name="song")
+    op.drop_index("ix_person_full_name_trgm", table_name="person")
+    op.drop_index("ix_song_location_trgm", table_name="song")
+    op.drop_index("ix_song_title_trgm", table_name="song")
+    op.drop_index("ix_song_search_vector", table_name="song")
+    op.execute("DROP TRIGGER person_search_vector_update ON person")
+    op.execute("DROP FUNCTION person_search_vector_update()")
+    op.execute("DROP TRIGGER song_search_vector_update ON song")
+    op.execute("DROP FUNCTION song_search_vector_update()")
+    op.drop_column("song", "search_vector")
+    op.execute("DROP FUNCTION f_unaccent(text)")
@@ -0,0 +1,48 @@
+"""add source stats table
+
+Revision ID: d3f6a2c9b184
+Revises: 5c2e8d41f7b9
+Create Date: 2026-10-18 19:40:12.804317
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "d3f6a2c9b184"
+down_revision: Union[str, None] = "5c2e8d41f7b9"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "sourcestats",
+        sa.Column("source_id", sa.Uuid(), nullable=False),
+        sa.Column("song_count", sa.Integer(), nullable=False),
+        sa.Column("location_count", sa.Integer(), nullable=False),
+        sa.Column("year_min", sa.Integer(), nullable=True),
+        sa.Column("year_max", sa.Integer(), nullable=True),
+        sa.Column("updated", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["source_id"], ["source.id"], ondelete="CASCADE"),
+        sa.PrimaryKeyConstraint("source_id"),
+    )
+    op.execute(
+        """
+        INSERT INTO sourcestats
+            (source_id, song_count, location_count, year_min, year_max, updated)
+        SELECT source_id, count(*), count(DISTINCT location), min(year), max(year),
+            CURRENT_TIMESTAMP
+        FROM song
+        WHERE source_id IS NOT NULL
+        GROUP BY source_id
+        """
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("sourcestats")
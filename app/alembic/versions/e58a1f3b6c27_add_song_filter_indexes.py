@@ -0,0 +1,28 @@
+"""add song filter indexes
+
+Revision ID: e58a1f3b6c27
+Revises: b94d07e5c613
+Create Date: 2026-10-18 21:12:30.904158
+
+"""
+from typing import Sequence
+from typing import Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "e58a1f3b6c27"
+down_revision: Union[str, None] = "b94d07e5c613"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_song_source_location", "song", ["source_id", "location"])
+    op.create_index("ix_song_source_signature", "song", ["source_id", "signature"])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_song_source_signature", table_name="song")
+    op.drop_index("ix_song_source_location", table_name="song")
@@ -0,0 +1,53 @@
+"""order song listing nulls last
+
+Revision ID: f2a7c5d19e40
+Revises: e58a1f3b6c27
+Create Date: 2026-10-18 22:03:17.215846
+
+"""
+from typing import Sequence
+from typing import Union
+
+import sqlalchemy as sa
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = "f2a7c5d19e40"
+down_revision: Union[str, None] = "e58a1f3b6c27"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # signature, number, page with NULLs last, see app.songs.pagination
+    op.drop_index("ix_song_source_order", table_name="song")
+    op.create_index(
+        "ix_song_source_order",
+        "song",
+        [
+            "source_id",
+            sa.text("(signature IS NULL)"),
+            sa.text("coalesce(signature, '')"),
+            sa.text("(number IS NULL)"),
+            sa.text("coalesce(number, -1)"),
+            sa.text("(page IS NULL)"),
+            sa.text("coalesce(page, -1)"),
+            "id",
+        ],
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_song_source_order", table_name="song")
+    op.create_index(
+        "ix_song_source_order",
+        "song",
+        [
+            "source_id",
+            sa.text("coalesce(signature, '')"),
+            sa.text("coalesce(page, -1)"),
+            sa.text("coalesce(number, -1)"),
+            "id",
+        ],
+    )
@@ -0,0 +1,204 @@
+import hashlib
+import shutil
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from pathlib import Path
+
+from sqlmodel import select
+
+from . import config
+from . import db
+from .press.coordinator import coordinator
+from .songs.models import Song
+
+settings = config.get_settings()
+
+TMP_PATH = Path("app/tmp")
+
+
+def path_size(path):
+    if path.is_file():
+        return path.stat().st_size
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def is_uuid(name):
+    try:
+        uuid.UUID(name)
+    except ValueError:
+        return False
+    return True
+
+
+_digests = {}
+
+
+def is_served(name):
+    """Whether `name` is in a song preview or editor preview directory."""
+    parts = Path(name).parts
+    if len(parts) >= 2 and is_uuid(parts[0]):
+        return True
+    return len(parts) >= 3 and parts[0] == "editor" and is_uuid(parts[1])
+
+
+def artifact_path(name, tmp_path=TMP_PATH):
+    """
+    Path of the artifact served as /tmp/`name`, or None outside `tmp_path`
+    or outside the previews. Jobs, locks and caches are never served.
+    """
+    root = tmp_path.resolve()
+    path = (root / name).resolve()
+    if not path.is_relative_to(root) or not path.is_file():
+        return None
+    if not is_served(path.relative_to(root)):
+        return None
+    return path
+
+
+def artifact_digest(path):
+    """
+    Short content hash of the file at `path`, None if it doesn't exist.
+
+    Hashes are remembered until the file's mtime or size change, so templates
+    can fingerprint dozens of previews per page without reading them.
+    """
+    try:
+        stat = path.stat()
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    cached = _digests.get(path)
+    if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+        return cached[1]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    _digests[path] = ((stat.st_mtime_ns, stat.st_size), digest.hexdigest()[:16])
+    return _digests[path][1]
+
+
+def artifact_url(name):
+    """
+    Fingerprinted URL of the artifact `name` relative to app/tmp.
+
+    The URL changes whenever the file does, so it is served as immutable.
+    Artifacts not built yet get their plain /tmp URL.
+    """
+    name = str(name)
+    digest = artifact_digest(TMP_PATH / name)
+    if digest is None:
+        return "/tmp/" + name
+    return f"/artifact/{digest}/{name}"
+
+
+def find_artifacts(tmp_path):
+    """
+    Yield `(path, lock_key)` for every evictable unit under `tmp_path`.
+
+    `lock_key` is the build coordinator key that produces the artifact, or
+    None for artifacts not built through the coordinator.
+    """
+    for path in tmp_path.iterdir():
+        if is_uuid(path.name):
+            yield path, "song-" + path.name
+    for path in (tmp_path / "editor").glob("*"):
+        yield path, None
+    for path in (tmp_path / "songbooks").glob("*/*.pdf"):
+        if path.parent.name == "pages":
+            yield path, "page-" + path.stem
+        else:
+            yield path, "songbook-" + path.stem
+    for path in (tmp_path / "snippets").glob("*/*"):
+        if not path.name.startswith("."):
+            yield path, "snippet-" + path.name
+    for path in (tmp_path / "jobs").glob("*.json"):
+        yield path, None
+
+
+def collect_garbage(
+    quota_bytes=None, max_age=None, grace=None, tmp_path=TMP_PATH, verbose=False
+):
+    """
+    Evict build artifacts older than `max_age` seconds, then the least recently
+    used ones until everything under `tmp_path` fits in `quota_bytes`.
+
+    Previews of songs still in the database, artifacts touched in the last
+    `grace` seconds and artifacts whose build is running are never evicted.
+    Returns the number of reclaimed bytes.
+    """
+    quota_bytes = settings.tmp_quota_bytes if quota_bytes is None else quota_bytes
+    max_age = settings.tmp_max_age if max_age is None else max_age
+    grace = settings.tmp_gc_grace if grace is None else grace
+    if not tmp_path.exists():
+        return 0
+
+    with db.get_session() as session:
+        live_songs = {str(song_id) for song_id in session.exec(select(Song.id))}
+
+    now = time.time()
+    total = 0
+    candidates = []
+    for path, lock_key in find_artifacts(tmp_path):
+        try:
+            mtime = path.stat().st_mtime
+            size = path_size(path)
+        except FileNotFoundError:
+            continue
+        total += size
+        if path.parent == tmp_path and path.name in live_songs:
+            continue
+        if now - mtime < grace:
+            continue
+        candidates.append((mtime, size, path, lock_key))
+
+    reclaimed = 0
+    for mtime, size, path, lock_key in sorted(candidates, key=lambda c: c[0]):
+        expired = max_age and now - mtime > max_age
+        if not expired and total - reclaimed <= quota_bytes:
+            break
+        lock = coordinator.idle(lock_key) if lock_key else nullcontext(True)
+        with lock as idle:
+            if not idle:
+                continue
+            if path.is_dir():
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                path.unlink(missing_ok=True)
+            if lock_key:
+                coordinator.remove(lock_key)
+        reclaimed += size
+        if verbose:
+            print(f"Evicted {path} ({size} bytes)")
+
+    for path in (tmp_path / "songbooks").glob("*"):
+        if path.is_dir() and not any(path.iterdir()):
+            path.rmdir()
+
+    # locks of failed builds and of artifacts removed some other way
+    live_keys = {lock_key for _, lock_key in find_artifacts(tmp_path) if lock_key}
+    for lock_key, mtime in list(coordinator.lock_keys()):
+        if lock_key in live_keys or now - mtime < grace:
+            continue
+        with coordinator.idle(lock_key) as idle:
+            if idle:
+                coordinator.remove(lock_key)
+    return reclaimed
+
+
+def start_garbage_collector(interval=None):
+    interval = settings.tmp_gc_interval if interval is None else interval
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                reclaimed = collect_garbage()
+                print(f"Artifact GC reclaimed {reclaimed} bytes")
+            except Exception as e:
+                print(f"Artifact GC failed: {e}")
+
+    thread = threading.Thread(target=loop, name="artifact-gc", daemon=True)
+    thread.start()
+    return thread
@@ -1,5 +1,7 @@
+import os
 import sys
 from pathlib import Path
+from typing import List
 
 from pydantic import BaseSettings
 from pydantic import Field
@@ -15,10 +17,44 @@ class Settings(BaseSettings):
     jwt_algorithm: str = Field(default="HS256")
     session_duration: int = Field(default=86400)
     database_url: str = Field(default=None)
+    snippet_cache_dir: Path = Path(__file__).resolve().parent / "tmp" / "snippets"
+    snippet_cache_max_bytes: int = Field(default=512 * 1024 * 1024)
+    pdf_build_workers: int = Field(default=2)
+    # seconds between rewrites of running job records, see BuildJobs
+    pdf_job_heartbeat: int = Field(default=10)
+    engrave_workers: int = Field(default=os.cpu_count() or 1)
+    build_workers: int = Field(default=32)
+    render_batch_window: float = Field(default=0.2)
+    render_batch_size: int = Field(default=32)
+    render_batches_in_flight: int = Field(default=2)
+    editor_preview_delay: float = Field(default=0.3)
+    preview_format: str = Field(default="png")
+    preview_widths: List[int] = Field(default=[360, 720])
+    tmp_quota_bytes: int = Field(default=2 * 1024 * 1024 * 1024)
+    tmp_max_age: int = Field(default=30 * 86400)
+    tmp_gc_grace: int = Field(default=600)
+    tmp_gc_interval: int = Field(default=3600)
+    import_batch_size: int = Field(default=500)
+    import_workers: int = Field(default=min(32, (os.cpu_count() or 1) + 4))
+    # outside app/tmp, which is served, it lists paths of the data library
+    import_manifest_path: Path = (
+        Path(__file__).resolve().parent / "state" / "import-manifest.json"
+    )
+    reimport_delay: float = Field(default=2.0)
+    reimport_max_delay: float = Field(default=30.0)
+    reimport_build_workers: int = Field(default=4)
+    admin_stats_ttl: float = Field(default=30.0)
+    admin_stats_estimate_rows: int = Field(default=100_000)
 
     class Config:
         env_file = ".env"
 
+    @validator("preview_format")
+    def check_preview_format(cls, preview_format):
+        if preview_format not in ("png", "svg"):
+            raise ValueError("PREVIEW_FORMAT must be png or svg")
+        return preview_format
+
     @validator("database_url", pre=True)
     def fix_postgres_prefix(cls, database_url):
         if database_url.startswith("postgres://"):
@@ -3,10 +3,11 @@ from pathlib import Path
 from fastapi import Depends
 from fastapi import FastAPI
 from fastapi import Form
+from fastapi import HTTPException
 from fastapi import Request
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
-from sqlalchemy import func
+from sqlalchemy.orm import selectinload
 from sqlmodel import select
 from sqlmodel import Session
 from sqlmodel import SQLModel
@@ -17,16 +18,21 @@ from watchdog.observers import Observer
 from . import config
 from . import db
 from . import utils
+from .artifacts import start_garbage_collector
 from .routers.admin_router import router as admin_router
+from .routers.artifact_router import router as artifact_router
 from .routers.htmx_router import router as htmx_router
 from .routers.songbook_router import router as songbook_router
 from .shortcuts import redirect
 from .shortcuts import render
 from .songbooks.models import Songbook
-from .songs.importer import update_song  # noqa
 from .songs.models import Song
 from .songs.models import SongEdit
 from .songs.models import Source
+from .songs.models import SourceStats
+from .songs.pagination import keyset_page
+from .songs.search import search_songs
+from .songs.watcher import reimport_queue
 from .users.backend import JWTCookieBackend
 from .users.decorators import login_required
 from .users.models import User
@@ -36,6 +42,7 @@ from .users.schemas import UserSignupSchema
 app = FastAPI()
 app.add_middleware(AuthenticationMiddleware, backend=JWTCookieBackend())
 app.include_router(admin_router)
+app.include_router(artifact_router)
 app.include_router(htmx_router)
 app.include_router(songbook_router)
 settings = config.get_settings()
@@ -47,10 +54,6 @@ from .handlers import *  # noqa
 
 @app.on_event("startup")
 def on_startup():
-    # Mount the "tmp" folder to serve files
-    tmp_path = Path(__file__).parent / "tmp"
-    app.mount("/tmp", StaticFiles(directory=tmp_path), name="tmp")
-
     # Mount the "tmp" folder to serve files
     queue_path = Path(__file__).parent / "transcript_queue"
     app.mount(
@@ -63,33 +66,47 @@ def on_startup():
 
 
 class FileChangeHandler(FileSystemEventHandler):
+    # events only queue their song directory, imports run on the queue's worker
+    def on_created(self, event):
+        reimport_queue.add(event.src_path)
+
     def on_modified(self, event):
-        if event.is_directory and all(
-            not part.startswith(".") for part in Path(event.src_path).parts
-        ):
-            try:
-                update_song(Path(event.src_path))
-            except Exception as e:
-                print(f"Couldn't update song on {event.src_path}: {e}")
+        reimport_queue.add(event.src_path)
+
+    def on_moved(self, event):
+        reimport_queue.add(event.dest_path)
 
 
 @app.on_event("startup")
 def start_file_watcher():
     observer = Observer()
-    observer.schedule(FileChangeHandler(), "app/songs/data", recursive=True)
+    observer.schedule(FileChangeHandler(), str(reimport_queue.root), recursive=True)
     observer.start()
 
 
+@app.on_event("startup")
+def start_artifact_gc():
+    start_garbage_collector()
+
+
+def source_listing(session, *conditions):
+    """Sources with their SourceStats, read in one query."""
+    rows = session.exec(
+        select(Source, SourceStats)
+        .join(SourceStats, isouter=True)
+        .where(*conditions)
+        .options(selectinload(Source.authors))
+        .order_by(Source.title)
+    ).all()
+    return {
+        "sources": [source for source, _ in rows],
+        "source_stats": {source.id: stats or SourceStats() for source, stats in rows},
+    }
+
+
 @login_required
 def dashboard_view(request: Request, session: Session):
-    context = {}
-    context["sources"] = session.exec(select(Source)).all()
-    # OPTIMISE THIS PLEASE
-    context["songs_per_source"] = {}
-    for source in context["sources"]:
-        context["songs_per_source"][source.title] = str(
-            len(session.exec(select(Song).where(Song.source_id == source.id)).all())
-        )
+    context = source_listing(session)
     statement = select(Songbook).where(Songbook.user_id == request.user.username)
     context["songbooks"] = session.exec(statement).all()
     return render(request, "dashboard.html", context, status_code=200)
@@ -111,24 +128,7 @@ def homepage(request: Request, session: Session = Depends(db.yield_session)):
 
 @app.get("/landing", response_class=HTMLResponse)
 def landing_view(request: Request, session):
-    context = {}
-    context["sources"] = session.exec(
-        select(Source).where(Source.public.is_(True))
-    ).all()
-
-    # One query to get counts of songs per source
-    results = session.exec(
-        select(Song.source_id, func.count(Song.id)).group_by(Song.source_id)
-    ).all()
-
-    # Turn into a dictionary keyed by source_id
-    songs_per_source = {source_id: count for source_id, count in results}
-
-    # Map source titles to counts (default to 0 if no songs)
-    context["songs_per_source"] = {
-        source.title: str(songs_per_source.get(source.id, 0))
-        for source in context["sources"]
-    }
+    context = source_listing(session, Source.public.is_(True))
     return render(request, "landing.html", context)
 
 
@@ -222,26 +222,22 @@ def get_song_detail(
     )
 
 
-@app.get("/source/{source_id}/{page}", response_class=HTMLResponse)
+@app.get("/source/{source_id}/songs", response_class=HTMLResponse)
 def get_source_detail_page(
     request: Request,
     source_id: str,
-    page: int = 0,
+    cursor: str = "",
     session: Session = Depends(db.yield_session),
 ):
     statement = select(Source).where(Source.id == source_id)
     source = session.exec(statement).one()
 
-    statement = (
-        select(Song)
-        .where(Song.source_id == source_id)
-        .order_by(Song.signature)
-        .order_by(Song.page)
-        .order_by(Song.number)
-        .offset(10 * (page - 1))
-        .limit(10)
-    )
-    songs = session.exec(statement).all()
+    try:
+        songs, next_cursor = keyset_page(
+            session, select(Song).where(Song.source_id == source_id), cursor
+        )
+    except ValueError:
+        raise HTTPException(status_code=400)
 
     if request.user.is_authenticated:
         statement = select(Songbook).where(Songbook.user_id == request.user.username)
@@ -255,12 +251,49 @@ def get_source_detail_page(
             "source": source,
             "songs": songs,
             "songbooks": songbooks,
-            "page": page + 1,
+            "next_cursor": next_cursor,
             "infinite_scroll": True,
         },
     )
 
 
+def search_context(request, session, q, page):
+    songs, more = search_songs(session, q, page)
+    if request.user.is_authenticated:
+        statement = select(Songbook).where(Songbook.user_id == request.user.username)
+        songbooks = session.exec(statement).all()
+    else:
+        songbooks = []
+    return {
+        "q": q,
+        "songs": songs,
+        "songbooks": songbooks,
+        "next_page": page + 1 if more else None,
+        "infinite_scroll": False,
+    }
+
+
+@app.get("/search", response_class=HTMLResponse)
+def search_view(
+    request: Request, q: str = "", session: Session = Depends(db.yield_session)
+):
+    return render(request, "search.html", search_context(request, session, q, 1))
+
+
+@app.get("/search/results", response_class=HTMLResponse)
+def search_results(
+    request: Request,
+    q: str = "",
+    page: int = 1,
+    session: Session = Depends(db.yield_session),
+):
+    return render(
+        request,
+        "snippets/search_results.html",
+        search_context(request, session, q, max(page, 1)),
+    )
+
+
 def generate_filters(source, session) -> [dict]:
     filter_names = ["location", "title"]
     if source.type == "archive":
@@ -288,17 +321,9 @@ def get_source_detail(
     request: Request, source_id: str, session: Session = Depends(db.yield_session)
 ):
     source = session.exec(select(Source).where(Source.id == source_id)).one()
-    page = 1
-    statement = (
-        select(Song)
-        .where(Song.source_id == source_id)
-        .order_by(Song.signature)
-        .order_by(Song.page)
-        .order_by(Song.number)
-        .offset(10 * (page - 1))
-        .limit(10)
+    songs, next_cursor = keyset_page(
+        session, select(Song).where(Song.source_id == source_id)
     )
-    songs = session.exec(statement).all()
 
     filters = generate_filters(source, session)
 
@@ -314,7 +339,7 @@ def get_source_detail(
             "source": source,
             "songs": songs,
             "songbooks": songbooks,
-            "page": page + 1,
+            "next_cursor": next_cursor,
             "infinite_scroll": True,
             "filters": filters,
         },
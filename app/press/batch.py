@@ -0,0 +1,170 @@
+import os
+import queue
+import re
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from app import config
+
+settings = config.get_settings()
+
+
+class RenderBatcher:
+    """
+    Compile LilyPond sources submitted within a short window together.
+
+    A batch runs as one lilypond invocation over all its files, forked into
+    `job_count` jobs, so Guile and font startup is paid once per batch
+    instead of once per song. Outputs are moved back to each submitter's
+    directory under the usual `source.*` names.
+
+    Up to `max_in_flight` bulk batches compile at once, the next one keeps
+    collecting while they run. Interactive submissions, the editor previews,
+    have a lane of their own with no window, so they never wait behind a
+    bulk batch.
+
+    With `preview_format` "svg" lilypond writes SVG pages instead of PDF and
+    PNG, `main_output` names the file every successful compile produces.
+    """
+
+    def __init__(
+        self,
+        staging_root,
+        window,
+        max_batch,
+        job_count,
+        preview_format,
+        max_in_flight=1,
+    ):
+        self.staging_root = Path(staging_root)
+        self.window = window
+        self.max_batch = max_batch
+        self.job_count = job_count
+        self.preview_format = preview_format
+        self.max_in_flight = max_in_flight
+        self.main_output = "source.svg" if preview_format == "svg" else "source.pdf"
+        # lane: (queue, window, batches in flight)
+        self._lanes = {
+            "bulk": (queue.Queue(), window, max_in_flight),
+            "interactive": (queue.Queue(), 0, 1),
+        }
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_in_flight + 1, thread_name_prefix="lilypond-batch"
+        )
+        self._lock = threading.Lock()
+        self._threads = {}
+
+    def __repr__(self):
+        return f"RenderBatcher(window={self.window}, max_batch={self.max_batch})"
+
+    def submit(self, source, dest_path, interactive=False):
+        """
+        Queue `source` for compilation into `dest_path`, on the interactive
+        lane if `interactive`.
+
+        Returns a Future resolving to whether lilypond compiled it.
+        """
+        lane = "interactive" if interactive else "bulk"
+        future = Future()
+        self._lanes[lane][0].put((source, Path(dest_path), future))
+        with self._lock:
+            if lane not in self._threads:
+                self._threads[lane] = threading.Thread(
+                    target=self._loop,
+                    args=(lane,),
+                    name=f"lilypond-{lane}",
+                    daemon=True,
+                )
+                self._threads[lane].start()
+        return future
+
+    def _loop(self, lane):
+        items, window, in_flight = self._lanes[lane]
+        slots = threading.BoundedSemaphore(in_flight)
+        while True:
+            # wait for a free slot first, submissions meanwhile join the batch
+            slots.acquire()
+            batch = [items.get()]
+            deadline = time.monotonic() + window
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0:
+                        batch.append(items.get(timeout=timeout))
+                    else:
+                        batch.append(items.get_nowait())
+                except queue.Empty:
+                    break
+            # submitters may cancel until the batch starts compiling
+            batch = [item for item in batch if item[2].set_running_or_notify_cancel()]
+            if not batch:
+                slots.release()
+                continue
+            self._executor.submit(self._compile, batch, slots)
+
+    def _compile(self, batch, slots):
+        try:
+            self.compile(batch)
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            slots.release()
+
+    def compile(self, batch):
+        self.staging_root.mkdir(parents=True, exist_ok=True)
+        staging_path = Path(tempfile.mkdtemp(dir=self.staging_root))
+        try:
+            names = []
+            for index, (source, _, _) in enumerate(batch):
+                names.append(f"{index}.ly")
+                (staging_path / names[-1]).write_text(source)
+
+            # run inside the staging directory, -o with several files
+            # would name the first file's output after the directory
+            options = [f"-djob-count={min(self.job_count, len(batch))}"]
+            if self.preview_format == "svg":
+                options.append("-dbackend=svg")
+            proc = subprocess.run(
+                ["lilypond"] + options + names,
+                cwd=staging_path,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            failed = set()
+            for line in re.findall(r"failed files: (.*)", proc.stderr):
+                failed.update(re.findall(r'"([^"]+)"', line))
+
+            for index, (source, dest_path, future) in enumerate(batch):
+                main_output = self.main_output.replace("source", str(index), 1)
+                if names[index] in failed or not (staging_path / main_output).exists():
+                    print(f"Couldn't compile {dest_path}: {proc.stderr}")
+                    future.set_result(False)
+                    continue
+                dest_path.mkdir(parents=True, exist_ok=True)
+                for output in staging_path.glob(f"{index}.*"):
+                    if output.suffix != ".ly":
+                        suffix = output.name[len(str(index)) :]
+                        os.replace(output, dest_path / ("source" + suffix))
+                (dest_path / "source.lytex").write_text(source)
+                future.set_result(True)
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+
+
+render_batcher = RenderBatcher(
+    settings.base_dir / "tmp" / "batch",
+    settings.render_batch_window,
+    settings.render_batch_size,
+    settings.engrave_workers,
+    settings.preview_format,
+    settings.render_batches_in_flight,
+)
@@ -1,9 +1,36 @@
+import hashlib
+import json
+import os
 import re
+import shutil
 import subprocess
+import tempfile
+from concurrent.futures import as_completed
 from pathlib import Path
 
 import jinja2
 from jinja2 import Environment
+from pypdf import PdfWriter
+
+from .cache import lilypond_version
+from .cache import snippet_cache
+from .coordinator import coordinator
+
+
+BOOK_TEMPLATES = ["book_preamble.jinja2", "book.jinja2", "book_song.jinja2"]
+PAGES_PATH = Path("app/tmp/songbooks/pages")
+LATEX_SPECIALS = {
+    "\\": r"\textbackslash{}",
+    "&": r"\&",
+    "%": r"\%",
+    "$": r"\$",
+    "#": r"\#",
+    "_": r"\_",
+    "{": r"\{",
+    "}": r"\}",
+    "~": r"\textasciitilde{}",
+    "^": r"\textasciicircum{}",
+}
 
 
 def save(book, path):
@@ -11,6 +38,11 @@ def save(book, path):
         f.write(book)
 
 
+def latex_escape(text):
+    """`text` with the LaTeX special characters typeset as themselves."""
+    return re.sub(r"[\\&%$#_{}~^]", lambda m: LATEX_SPECIALS[m.group()], str(text))
+
+
 def compile_verses(src):
     # add \verse before every verse
     result = re.sub(r"(?:\n\n|^)", "\n\n\\\\verse\n", src, count=0, flags=0)
@@ -26,37 +58,68 @@ def compile_lytex(src):
     return "\\begin{lilypond}\n" + src + "\n\\end{lilypond}"
 
 
-def bake(songs, songbook, templates_dir):
-    for song in songs:
-        if song.verses:
-            song.verses = compile_verses(song.verses)
-        if song.lytex:
-            song.lytex = compile_lytex(song.lytex)
+def songbook_path(songbook):
+    return Path("app/tmp/songbooks/" + str(songbook.songbook_id))
+
+
+def templates_hash(templates_dir):
+    digest = hashlib.sha256()
+    for name in BOOK_TEMPLATES:
+        digest.update((Path(templates_dir) / name).read_bytes())
+    return digest.hexdigest()
 
-    env = Environment(
+
+def book_environment(templates_dir):
+    environment = Environment(
         block_start_string="{+",
         block_end_string="+}",
         loader=jinja2.FileSystemLoader(templates_dir),
     )
-    book_template = env.get_template("book.jinja2")
-    book = book_template.render({"songs": songs, "songbook": songbook})
+    environment.filters["latex_escape"] = latex_escape
+    return environment
 
-    dest_path = Path("app/tmp/songbooks/" + str(songbook.songbook_id))
-    dest_path.mkdir(parents=True, exist_ok=True)
-    lytex_path = dest_path / ("songbook" + ".lytex")
-    output_path = dest_path / "output"
-    tex_path = output_path / ("songbook" + ".tex")
-    save(book, lytex_path)
 
-    proc = subprocess.Popen(
-        ["lilypond-book", "--output=" + str(output_path), "--pdf", lytex_path],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
+def fingerprint(songs, songbook, templates_dir):
+    """Hash of everything that ends up in the songbook PDF."""
+    content = {
+        "title": songbook.title,
+        "description": songbook.description,
+        "template": templates_hash(templates_dir),
+        "lilypond": lilypond_version(),
+        "songs": [
+            [str(song.id), song.title, song.lytex, song.verses] for song in songs
+        ],
+    }
+    return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+
+def page_set_key(song, templates_dir):
+    """Hash of everything that ends up on the pages of a single song."""
+    content = {
+        "template": templates_hash(templates_dir),
+        "lilypond": lilypond_version(),
+        "song": [song.title, song.lytex, song.verses],
+    }
+    return hashlib.sha256(json.dumps(content).encode()).hexdigest()
+
+
+def baked_pdf(songs, songbook, templates_dir):
+    """Return the PDF already built for the current songbook content, if any."""
+    pdf_path = songbook_path(songbook) / (
+        fingerprint(songs, songbook, templates_dir) + ".pdf"
     )
-    proc.communicate()
-    #    subprocess.run(['lilypond-book', '--output=' + "output", '--pdf', lytex_path])
-    #    orig_dir = os.path.abspath(".")
-    #    os.chdir("output")
+    if pdf_path.exists():
+        return pdf_path
+    return None
+
+
+def collect_stale_pdfs(dest_path, pdf_path):
+    for stale_path in dest_path.glob("*.pdf"):
+        if stale_path != pdf_path:
+            stale_path.unlink(missing_ok=True)
+
+
+def pdflatex(tex_path, output_path):
     proc = subprocess.Popen(
         [
             "pdflatex",
@@ -71,5 +134,139 @@ def bake(songs, songbook, templates_dir):
         proc.communicate()
     except Exception as e:
         print(e)
+        return None
+    # nonstopmode writes what it could even after an error
+    if proc.returncode != 0:
+        return None
+    return output_path / (tex_path.stem + ".pdf")
 
-    return output_path / "songbook.pdf"
+
+def typeset(document, name, output_path):
+    """Run pdflatex over `document` in a scratch directory, move the PDF out."""
+    output_path.mkdir(parents=True, exist_ok=True)
+    work_path = Path(tempfile.mkdtemp(prefix=".", dir=output_path))
+    try:
+        tex_path = work_path / (name + ".tex")
+        save(document, tex_path)
+        built_path = pdflatex(tex_path, work_path)
+        if built_path is None or not built_path.exists():
+            print(f"Couldn't typeset {name}")
+            return None
+        pdf_path = output_path / (name + ".pdf")
+        os.replace(built_path, pdf_path)
+        return pdf_path
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+
+
+def typeset_page_set(document, key):
+    """
+    Return the PDF pages typeset from `document()`, or None if they couldn't
+    be. `document()` returns None when part of the page failed to build.
+
+    Page sets are cached by `key` under PAGES_PATH, so the same song or title
+    page is typeset once for every songbook and every order it appears in.
+    Failures are not cached, the next build tries again.
+    """
+    pdf_path = PAGES_PATH / (key + ".pdf")
+    if pdf_path.exists():
+        os.utime(pdf_path)
+        return pdf_path
+
+    def build():
+        source = document()
+        if source is None:
+            return None
+        return typeset(source, key, PAGES_PATH)
+
+    return coordinator.run(
+        "page-" + key,
+        build,
+        done=lambda: pdf_path if pdf_path.exists() else None,
+    )
+
+
+def typeset_song(song, templates_dir):
+    def document():
+        lytex = None
+        if song.lytex:
+            lytex = snippet_cache.fragment(song.lytex)
+            if lytex is None:
+                # a page without its score would be cached for good
+                print(f"Couldn't engrave {song}")
+                return None
+        verses = None
+        if song.verses:
+            verses = compile_verses(latex_escape(song.verses))
+        book_song = {"title": song.title, "lytex": lytex, "verses": verses}
+        song_template = book_environment(templates_dir).get_template("book_song.jinja2")
+        return song_template.render({"song": book_song})
+
+    return typeset_page_set(document, page_set_key(song, templates_dir))
+
+
+def typeset_title(songbook, templates_dir):
+    book_template = book_environment(templates_dir).get_template("book.jinja2")
+    title = book_template.render({"songbook": songbook})
+    return typeset_page_set(lambda: title, hashlib.sha256(title.encode()).hexdigest())
+
+
+def bake(songs, songbook, templates_dir, progress=None):
+    """
+    Return the PDF of `songbook`, building what is missing, or None if a
+    song or the title page couldn't be typeset.
+    """
+    dest_path = songbook_path(songbook)
+    pdf_path = dest_path / (fingerprint(songs, songbook, templates_dir) + ".pdf")
+    if pdf_path.exists():
+        return pdf_path
+
+    def assemble():
+        # page sets are typeset on the lilypond executor, assembly is the last step
+        total = len(songs) + 1
+        futures = [
+            snippet_cache.executor.submit(typeset_song, song, templates_dir)
+            for song in songs
+        ]
+        for done, _ in enumerate(as_completed(futures), start=1):
+            if progress:
+                progress(done, total)
+        page_sets = [typeset_title(songbook, templates_dir)] + [
+            future.result() for future in futures
+        ]
+        # snippets are in the page sets now, trim the store once per build
+        snippet_cache.evict()
+        stats = snippet_cache.stats()
+        print(
+            f"Snippet cache: {stats['hits']} hits, {stats['misses']} misses, "
+            f"{stats['evictions']} evictions"
+        )
+        # an incomplete book would be served until the songbook changes
+        if not all(page_sets):
+            failed = [
+                str(song)
+                for song, page_set in zip(songs, page_sets[1:])
+                if page_set is None
+            ]
+            if page_sets[0] is None:
+                failed.insert(0, "the title page")
+            print(f"Couldn't build songbook {songbook}: {', '.join(failed)} failed")
+            return None
+
+        # reordering or removing songs only changes this concatenation
+        writer = PdfWriter()
+        for page_set in page_sets:
+            writer.append(page_set)
+        dest_path.mkdir(parents=True, exist_ok=True)
+        tmp_path = pdf_path.with_suffix(".tmp")
+        writer.write(tmp_path)
+        writer.close()
+        os.replace(tmp_path, pdf_path)
+        collect_stale_pdfs(dest_path, pdf_path)
+        return pdf_path
+
+    return coordinator.run(
+        "songbook-" + pdf_path.stem,
+        assemble,
+        done=lambda: pdf_path if pdf_path.exists() else None,
+    )
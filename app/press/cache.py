@@ -0,0 +1,179 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+
+from .coordinator import coordinator
+from app import config
+
+settings = config.get_settings()
+
+# Same layout lilypond-book uses for its snippets, with the line width of the
+# a4 geometry text block used by book.jinja2.
+SNIPPET_PREAMBLE = """\\include "lilypond-book-preamble.ly"
+\\paper {
+  line-width = 418.25\\pt
+  indent = 0\\mm
+}
+"""
+
+
+@lru_cache(maxsize=None)
+def lilypond_version():
+    proc = subprocess.run(["lilypond", "--version"], capture_output=True, text=True)
+    return proc.stdout.splitlines()[0].strip()
+
+
+def snippet_key(body):
+    digest = hashlib.sha256()
+    digest.update(lilypond_version().encode())
+    digest.update(b"\0")
+    digest.update(body.encode())
+    return digest.hexdigest()
+
+
+def dir_size(path):
+    return sum(f.stat().st_size for f in Path(path).rglob("*") if f.is_file())
+
+
+class SnippetCache:
+    """
+    Engraved LilyPond snippets shared by every songbook build.
+
+    Entries live in `<root>/<key[:2]>/<key>/` where the key is a hash of the
+    snippet body and the LilyPond version, so the same song is engraved once
+    no matter how many songbooks include it.
+    """
+
+    def __init__(self, root, max_bytes, workers):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        # shared by all builds, each job waits on a lilypond or pdflatex process
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="lilypond"
+        )
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"SnippetCache(root={self.root}, max_bytes={self.max_bytes})"
+
+    def entry_path(self, key):
+        return self.root / key[:2] / key
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def lookup(self, key):
+        path = self.entry_path(key)
+        if not (path / "snippet.tex").exists():
+            return None
+        # mtime is the recency used by evict()
+        os.utime(path)
+        return path
+
+    def fragment(self, body):
+        """Return the LaTeX that includes the engraved `body`, engraving on a miss."""
+        key = snippet_key(body)
+        path = self.lookup(key)
+        with self._lock:
+            if path:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if not path:
+            path = coordinator.run(
+                "snippet-" + key,
+                lambda: self.engrave(key, body),
+                done=lambda: self.lookup(key),
+            )
+            if not path:
+                return None
+        return (
+            "{%\n\\parindent 0pt\n\\noindent\n\\input{"
+            + str(path / "snippet.tex")
+            + "}%\n}"
+        )
+
+    def engrave(self, key, body):
+        path = self.entry_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        work_path = Path(tempfile.mkdtemp(prefix="." + key, dir=path.parent))
+        try:
+            source = work_path / "snippet.ly"
+            source.write_text(SNIPPET_PREAMBLE + body)
+            proc = subprocess.run(
+                [
+                    "lilypond",
+                    "--formats=ps",
+                    "-daux-files",
+                    "-dinclude-eps-fonts",
+                    "-dgs-load-fonts",
+                    "-dseparate-page-formats=eps,pdf",
+                    "-o",
+                    str(work_path / "snippet"),
+                    str(source),
+                ],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+            )
+            systems = work_path / "snippet-systems.tex"
+            if proc.returncode != 0 or not systems.exists():
+                print(f"Couldn't engrave snippet {key}: {proc.stderr}")
+                return None
+
+            # point the system images at the final entry path
+            (work_path / "snippet.tex").write_text(
+                systems.read_text().replace(
+                    "\\includegraphics{", "\\includegraphics{" + str(path) + "/"
+                )
+            )
+            try:
+                work_path.rename(path)
+            except OSError:
+                # another build stored the same snippet meanwhile
+                pass
+            return path
+        finally:
+            shutil.rmtree(work_path, ignore_errors=True)
+
+    def evict(self):
+        """
+        Drop least recently used entries until the store fits `max_bytes`.
+
+        Every entry is measured, builds call this once when they are done
+        rather than after each engraved snippet.
+        """
+        entries = [
+            (entry.stat().st_mtime, dir_size(entry), entry)
+            for entry in self.root.glob("*/*")
+            if entry.is_dir() and not entry.name.startswith(".")
+        ]
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries, key=lambda item: item[0]):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            with self._lock:
+                self.evictions += 1
+
+
+snippet_cache = SnippetCache(
+    settings.snippet_cache_dir,
+    settings.snippet_cache_max_bytes,
+    settings.engrave_workers,
+)
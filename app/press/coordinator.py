@@ -0,0 +1,131 @@
+import fcntl
+import os
+import re
+import threading
+from concurrent.futures import Future
+from concurrent.futures import wait
+from contextlib import contextmanager
+from pathlib import Path
+
+from app import config
+
+settings = config.get_settings()
+
+
+class BuildCoordinator:
+    """
+    Run at most one build per artifact key at a time.
+
+    Threads of one process share the result of the build in flight, other
+    uvicorn workers wait on an advisory lock file and pick the finished
+    artifact up through `done` instead of building it again.
+    """
+
+    def __init__(self, lock_dir):
+        self.lock_dir = Path(lock_dir)
+        self._lock = threading.Lock()
+        self._in_flight = {}
+
+    def __repr__(self):
+        return f"BuildCoordinator(lock_dir={self.lock_dir})"
+
+    def lock_path(self, key):
+        return self.lock_dir / (re.sub(r"[^\w.-]", "_", key) + ".lock")
+
+    def run(self, key, build, done=None, version=None):
+        """
+        Return `build()` for the artifact `key`, or the result of the build
+        of the same `version` already running for it.
+
+        `done()` returns the finished artifact or None. It is checked once the
+        lock is held, so an artifact finished by another process is reused.
+        A build of another `version`, like an older source of the same song,
+        is waited for and then built over instead of being shared.
+        """
+        while True:
+            with self._lock:
+                running = self._in_flight.get(key)
+                if running is None:
+                    future = Future()
+                    self._in_flight[key] = (version, future)
+                    break
+            running_version, running_future = running
+            if running_version == version:
+                return running_future.result()
+            wait([running_future])
+
+        try:
+            result = self._run_locked(key, build, done)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+    @contextmanager
+    def idle(self, key):
+        """
+        Yield whether no build is running for `key`, holding its lock if so.
+
+        Keys that were never built have no lock file and count as idle.
+        """
+        try:
+            lock_file = open(self.lock_path(key), "r")
+        except FileNotFoundError:
+            yield True
+            return
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def remove(self, key):
+        """Delete the lock file of `key`, the caller holds it through idle()."""
+        self.lock_path(key).unlink(missing_ok=True)
+
+    def lock_keys(self):
+        """Yield `(key, mtime)` of every lock file."""
+        for path in self.lock_dir.glob("*.lock"):
+            try:
+                yield path.stem, path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+
+    def _open_locked(self, key):
+        # the lock file may be removed by remove() while we wait for it, the
+        # lock is only valid on the file still at its path
+        path = self.lock_path(key)
+        while True:
+            lock_file = open(path, "w")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.fstat(lock_file.fileno()).st_ino == os.stat(path).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+
+    def _run_locked(self, key, build, done):
+        self.lock_dir.mkdir(parents=True, exist_ok=True)
+        with self._open_locked(key) as lock_file:
+            try:
+                if done:
+                    result = done()
+                    if result is not None:
+                        return result
+                return build()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+coordinator = BuildCoordinator(settings.base_dir / "tmp" / "locks")
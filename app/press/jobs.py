@@ -0,0 +1,169 @@
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from .book import bake
+from .book import fingerprint
+from .book import songbook_path
+from app import config
+
+settings = config.get_settings()
+
+ACTIVE = ("queued", "running")
+# job ids are derived from the user and the songbook content
+JOB_NAMESPACE = uuid.UUID("6f1d2c9e-4b7a-4e31-9a55-0c8e3f2b7d14")
+
+
+class BuildJobs:
+    """
+    Songbook PDF builds running on a bounded executor off the request threads.
+
+    Job state is kept as JSON records under `root` so any uvicorn worker can
+    answer status polls, not only the one that accepted the job. A job's id
+    follows from its user and songbook content, so repeated requests from
+    any worker find the job already queued. The worker owning a job rewrites
+    its record every `heartbeat` seconds, a queued or running job left
+    unwritten for three of them lost its worker and is read as failed.
+    """
+
+    def __init__(self, root, max_workers, heartbeat):
+        self.root = Path(root)
+        self.heartbeat = heartbeat
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="songbook-build"
+        )
+        self._lock = threading.Lock()
+        # records of the jobs queued or running in this process, by id
+        self._jobs = {}
+        self._thread = None
+
+    def __repr__(self):
+        return f"BuildJobs(root={self.root})"
+
+    def job_path(self, job_id):
+        return self.root / (str(job_id) + ".json")
+
+    def get(self, job_id):
+        try:
+            uuid.UUID(str(job_id))
+            with open(self.job_path(job_id), "r") as f:
+                job = json.load(f)
+        except (ValueError, OSError):
+            return None
+        if job["status"] in ACTIVE and self.stale(job):
+            job.update(status="failed", error="The build was interrupted")
+            self.save(job)
+        return job
+
+    def stale(self, job):
+        return time.time() - job.get("updated", 0) > 3 * self.heartbeat
+
+    @contextmanager
+    def submitting(self):
+        """Hold the lock serializing submissions of every uvicorn worker."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / "submit.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    def save(self, job):
+        job["updated"] = time.time()
+        self.root.mkdir(parents=True, exist_ok=True)
+        path = self.job_path(job["id"])
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def update(self, job, **kwargs):
+        # the heartbeat saves the same records
+        with self._lock:
+            job.update(kwargs)
+            self.save(job)
+
+    def submit(self, user_id, songs, songbook, templates_dir):
+        digest = fingerprint(songs, songbook, templates_dir)
+        job = {
+            "id": str(uuid.uuid5(JOB_NAMESPACE, f"{user_id}/{digest}")),
+            "user_id": str(user_id),
+            "songbook_id": str(songbook.songbook_id),
+            "title": songbook.title,
+            "status": "queued",
+            "progress": 0,
+            "pdf_path": None,
+            "error": None,
+        }
+        pdf_path = songbook_path(songbook) / (digest + ".pdf")
+        if pdf_path.exists():
+            # nothing changed since the last build, no need to queue anything
+            self.update(job, status="done", progress=100, pdf_path=str(pdf_path))
+            return job
+        with self.submitting():
+            # repeated requests for the same content follow the queued build
+            active = self.get(job["id"])
+            if active and active["status"] in ACTIVE:
+                return active
+            with self._lock:
+                self._jobs[job["id"]] = job
+                self.save(job)
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._beat, name="songbook-jobs", daemon=True
+                    )
+                    self._thread.start()
+        self.executor.submit(self.run, job, songs, songbook, templates_dir)
+        return job
+
+    def run(self, job, songs, songbook, templates_dir):
+        try:
+            self.build(job, songs, songbook, templates_dir)
+        except Exception as e:
+            print(f"Couldn't build songbook {job['songbook_id']}: {e}")
+            self.update(job, status="failed", error=str(e))
+        finally:
+            with self._lock:
+                # a new job of the same content may have replaced this one
+                if self._jobs.get(job["id"]) is job:
+                    del self._jobs[job["id"]]
+
+    def _beat(self):
+        while True:
+            time.sleep(self.heartbeat)
+            with self._lock:
+                for job in self._jobs.values():
+                    try:
+                        self.save(job)
+                    except OSError as e:
+                        print(f"Couldn't save songbook job {job['id']}: {e}")
+
+    def build(self, job, songs, songbook, templates_dir):
+        self.update(job, status="running")
+
+        def progress(done, total):
+            self.update(job, progress=int(100 * done / total))
+
+        try:
+            pdf_path = bake(songs, songbook, templates_dir, progress=progress)
+        except Exception as e:
+            print(f"Couldn't build songbook {job['songbook_id']}: {e}")
+            self.update(job, status="failed", error=str(e))
+            return
+        if not pdf_path or not Path(pdf_path).exists():
+            self.update(
+                job, status="failed", error="A song or the title page failed to build"
+            )
+            return
+        self.update(job, status="done", progress=100, pdf_path=str(pdf_path))
+
+
+build_jobs = BuildJobs(
+    settings.base_dir / "tmp" / "jobs",
+    settings.pdf_build_workers,
+    settings.pdf_job_heartbeat,
+)
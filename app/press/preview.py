@@ -0,0 +1,80 @@
+import asyncio
+import hashlib
+from pathlib import Path
+
+from .batch import render_batcher
+from app import config
+
+settings = config.get_settings()
+
+
+class EditorPreviews:
+    """
+    Render song editor previews, one at a time per SongEdit.
+
+    Saves arriving within `delay` seconds of each other are debounced, a newer
+    save drops the pending render of an older one, and a source identical to
+    the last successful render is not compiled again.
+    """
+
+    def __init__(self, root, delay):
+        self.root = Path(root)
+        self.delay = delay
+        self._generations = {}
+        self._pending = {}
+
+    def __repr__(self):
+        return f"EditorPreviews(root={self.root})"
+
+    def dest_path(self, edit_id):
+        return self.root / str(edit_id)
+
+    async def render(self, edit_id, source):
+        """
+        Compile `source` as the preview of `edit_id`.
+
+        Returns whether the preview now shows `source`, False when the
+        render was superseded by a newer save or failed.
+        """
+        dest_path = self.dest_path(edit_id)
+        manifest_path = dest_path / "source.sha256"
+        digest = hashlib.sha256(source.encode()).hexdigest()
+
+        generation = self._generations.get(edit_id, 0) + 1
+        self._generations[edit_id] = generation
+        pending = self._pending.pop(edit_id, None)
+        if pending:
+            # not picked up by the batcher yet, it would be overwritten anyway
+            pending.cancel()
+        try:
+            await asyncio.sleep(self.delay)
+            if self._generations[edit_id] != generation:
+                return False
+            try:
+                if manifest_path.read_text() == digest:
+                    return True
+            except FileNotFoundError:
+                pass
+
+            # the directory no longer matches any source until this render ends
+            manifest_path.unlink(missing_ok=True)
+            future = render_batcher.submit(source, dest_path, interactive=True)
+            self._pending[edit_id] = future
+            try:
+                compiled = await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+                return False
+            if compiled and self._generations.get(edit_id) == generation:
+                manifest_path.write_text(digest)
+            return compiled
+        finally:
+            if self._generations.get(edit_id) == generation:
+                del self._generations[edit_id]
+                self._pending.pop(edit_id, None)
+
+
+editor_previews = EditorPreviews(
+    settings.base_dir / "tmp" / "editor", settings.editor_preview_delay
+)
@@ -14,6 +14,7 @@ from sqlmodel import Session
 
 from app import config
 from app import db
+from app.press.cache import snippet_cache
 from app.shortcuts import redirect
 from app.shortcuts import render
 from app.songbooks import models as songbooksmodels
@@ -24,6 +25,8 @@ from app.songs.importer import import_folder
 from app.songs.models import Song
 from app.songs.models import SongEdit
 from app.songs.models import Source
+from app.songs.watcher import reimport_queue
+from app.stats import admin_stats
 from app.users import models as usermodels
 from app.users.decorators import admin_login_required
 from app.users.models import User
@@ -38,31 +41,18 @@ settings = config.get_settings()
 def admin_view(request: Request, session: Session = Depends(db.yield_session)):
     classes, class_names = get_classes()
 
-    # Query counts from the database
-    num_users = str(len(session.exec(select(User)).all()))
-    num_songs = str(len(session.exec(select(Song)).all()))
+    # counts are cached for a short while, big tables are estimated
+    stats = admin_stats.snapshot(session)
     sources = session.exec(select(Source)).all()
-    num_sources = str(len(sources))
-    num_songedits = str(len(session.exec(select(SongEdit)).all()))
-
-    data_path = Path(__file__).parent.parent / "songs" / "data"
-    folders = [
-        {
-            "name": f.name,  # what you display in the template
-            "path": f.resolve(),  # absolute path, for backend actions or HTMX
-        }
-        for f in data_path.iterdir()
-        if f.is_dir() and not f.name.startswith(".")
-    ]
 
     context = {
         "classes": class_names,
-        "num_users": num_users,
-        "num_songs": num_songs,
-        "num_sources": num_sources,
-        "num_songedits": num_songedits,
-        "folders": folders,
+        "counts": stats["counts"],
+        "approximate": stats["approximate"],
+        "folders": stats["folders"],
         "sources": sources,
+        "reimport": reimport_queue.stats(),
+        "snippets": snippet_cache.stats(),
     }
 
     return render(request, "admin/admin.html", context, status_code=200)
@@ -238,6 +228,7 @@ def admin_delete_object(
     instance = session.exec(select(cls).where(getattr(cls, id_name) == _id)).one()
     session.delete(instance)
     session.commit()
+    admin_stats.invalidate()
     return HTMLResponse("", status_code=200)
 
 
@@ -0,0 +1,39 @@
+from fastapi import APIRouter
+from fastapi import HTTPException
+from fastapi import Request
+from fastapi.responses import FileResponse
+from fastapi.responses import Response
+
+from app import config
+from app.artifacts import artifact_digest
+from app.artifacts import artifact_path
+from app.shortcuts import not_modified
+
+router = APIRouter()
+settings = config.get_settings()
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+def artifact_response(request, name, cache_control):
+    path = artifact_path(name)
+    if path is None:
+        raise HTTPException(status_code=404)
+    headers = {"ETag": f'"{artifact_digest(path)}"', "Cache-Control": cache_control}
+    if not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers)
+
+
+@router.get("/artifact/{digest}/{name:path}", response_class=FileResponse)
+def get_artifact(request: Request, digest: str, name: str):
+    # an outdated fingerprint still gets the current file, just not for keeps
+    path = artifact_path(name)
+    fresh = path is not None and artifact_digest(path) == digest
+    return artifact_response(request, name, IMMUTABLE if fresh else REVALIDATE)
+
+
+@router.get("/tmp/{name:path}", response_class=FileResponse)
+def get_legacy_artifact(request: Request, name: str):
+    return artifact_response(request, name, REVALIDATE)
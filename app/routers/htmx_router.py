@@ -1,6 +1,5 @@
 import json
-import subprocess
-from pathlib import Path
+import uuid
 from typing import Union
 
 import jinja2
@@ -8,6 +7,7 @@ from fastapi import APIRouter
 from fastapi import Cookie
 from fastapi import Depends
 from fastapi import Form
+from fastapi import HTTPException
 from fastapi import Request
 from fastapi import Response
 from fastapi.responses import HTMLResponse
@@ -19,12 +19,15 @@ from typing_extensions import Annotated
 
 from app import config
 from app import db
+from app.press.preview import editor_previews
 from app.shortcuts import render
 from app.songbooks.models import Entry
 from app.songbooks.models import Songbook
 from app.songs.models import Song
 from app.songs.models import SongEdit
 from app.songs.models import Source
+from app.songs.pagination import keyset_page
+from app.songs.search import title_matches
 from app.users.decorators import login_required
 from app.users.exceptions import UserDoesntExistException
 from app.users.models import User
@@ -179,28 +182,37 @@ async def post_source_filter(
     session: Session = Depends(db.yield_session),
 ):
     form_data = await request.form()
-    source_id = form_data.get("source_id")
+    try:
+        # a string only compares to the UUID column on PostgreSQL
+        source_id = uuid.UUID(form_data.get("source_id"))
+    except (TypeError, ValueError):
+        raise HTTPException(status_code=400)
+    cursor = form_data.get("cursor")
 
     statement = select(Song).where(Song.source_id == source_id)
     for key, value in form_data.items():
         if not value:
             continue
-        if key == "source_id":
+        if key in ("source_id", "cursor"):
             continue
         if key == "title":
-            statement = statement.filter(
-                func.similarity(func.unaccent(Song.title), func.unaccent(value)) > 0.5
-            )
+            statement = statement.filter(title_matches(session, value))
         else:
             data = json.loads(value)
             values = [item["value"] for item in data]
             song_column = getattr(Song, key, None)
             statement = statement.filter(song_column.in_(values))
 
-    statement = (
-        statement.order_by(Song.signature).order_by(Song.number).order_by(Song.page)
-    )
-    songs = session.exec(statement).all()
+    try:
+        songs, next_cursor = keyset_page(session, statement, cursor)
+    except ValueError:
+        raise HTTPException(status_code=400)
+    # counted once for the first page, without fetching the matching rows
+    total = None
+    if not cursor:
+        total = session.exec(
+            statement.with_only_columns(func.count()).order_by(None)
+        ).one()
 
     statement = select(Source).where(Source.id == source_id)
     source = session.exec(statement).one()
@@ -219,12 +231,15 @@ async def post_source_filter(
         songbooks = []
     return render(
         request,
-        "snippets/songs_accordion_partial.html",
+        "snippets/filter_results.html",
         {
             "source": source,
             "songs": songs,
             "songbooks": songbooks,
-            "infinite_scroll": False,
+            "next_cursor": next_cursor,
+            "total": total,
+            "infinite_scroll": True,
+            "filtered": True,
         },
     )
 
@@ -323,14 +338,7 @@ async def post_songbook_editor_update_lytex(
     song_template = env.get_template("song.jinja2")
     song_lytex = song_template.render(template_data)
 
-    dest_path = Path("app/tmp/editor/" + uuid)
-    dest_path.mkdir(parents=True, exist_ok=True)
-    source = dest_path / "source.lytex"
-
-    with source.open(mode="w") as file:
-        source_lytex = "#(ly:set-option 'crop #t)\n" + song_lytex
-        file.write(source_lytex)
-
-    subprocess.run(["lilypond", "-o", dest_path.resolve(), source.resolve()])
+    source_lytex = "#(ly:set-option 'crop #t)\n" + song_lytex
+    await editor_previews.render(uuid, source_lytex)
 
     return
@@ -1,13 +1,20 @@
+import re
+from pathlib import Path
+
 from fastapi import APIRouter
 from fastapi import Depends
+from fastapi import HTTPException
 from fastapi import Request
 from fastapi.responses import FileResponse
 from fastapi.responses import HTMLResponse
+from fastapi.responses import Response
 from sqlmodel import Session
 
 from app import config
 from app import db
-from app.press.book import bake
+from app.press.book import baked_pdf
+from app.press.jobs import build_jobs
+from app.shortcuts import not_modified
 from app.shortcuts import render
 from app.songbooks.models import Entry
 from app.songbooks.models import Songbook
@@ -17,6 +24,25 @@ router = APIRouter()
 settings = config.get_settings()
 
 
+def pdf_response(request, pdf_path, title):
+    """
+    Serve a songbook PDF inline, validated by the build fingerprint it is
+    named after. FileResponse streams it and answers Range requests, so PDF
+    viewers can show the first pages before the rest arrives.
+    """
+    headers = {"ETag": f'"{Path(pdf_path).stem}"', "Cache-Control": "private, no-cache"}
+    if not_modified(request, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    filename = re.sub(r'[\\/:*?"<>|\s]+', " ", title or "").strip() or "songbook"
+    return FileResponse(
+        pdf_path,
+        media_type="application/pdf",
+        filename=filename + ".pdf",
+        content_disposition_type="inline",
+        headers=headers,
+    )
+
+
 @router.get("/songbook_pdf/{songbook_id}", response_class=FileResponse)
 @login_required
 def get_songbook_pdf(
@@ -26,8 +52,60 @@ def get_songbook_pdf(
         request.user.username, songbook_id, session
     )
     songs = Entry.get_songs(songbook.songbook_id, session)
-    pdf_path = bake(songs, songbook, settings.templates_dir)
-    return FileResponse(pdf_path)
+    pdf_path = baked_pdf(songs, songbook, settings.templates_dir)
+    if pdf_path:
+        return pdf_response(request, pdf_path, songbook.title)
+    # never build on a request thread, queue it and show its progress
+    job = build_jobs.submit(
+        request.user.username, songs, songbook, settings.templates_dir
+    )
+    if job["status"] == "done":
+        return pdf_response(request, job["pdf_path"], songbook.title)
+    template = "songbook_pdf.html"
+    if request.headers.get("hx-request"):
+        template = "htmx/songbook_pdf_job.html"
+    return render(
+        request, template, {"job": job, "songbook": songbook}, status_code=202
+    )
+
+
+@router.post("/songbook_pdf/{songbook_id}", response_class=HTMLResponse)
+@login_required
+def post_songbook_pdf(
+    request: Request, songbook_id: str, session: Session = Depends(db.yield_session)
+):
+    songbook = Songbook.get_by_user_songbook_id(
+        request.user.username, songbook_id, session
+    )
+    songs = Entry.get_songs(songbook.songbook_id, session)
+    job = build_jobs.submit(
+        request.user.username, songs, songbook, settings.templates_dir
+    )
+    return render(request, "htmx/songbook_pdf_job.html", {"job": job})
+
+
+def get_user_job(request, job_id):
+    job = build_jobs.get(job_id)
+    if not job or job["user_id"] != str(request.user.username):
+        raise HTTPException(status_code=404)
+    return job
+
+
+@router.get("/songbook_pdf/job/{job_id}", response_class=HTMLResponse)
+@login_required
+def get_songbook_pdf_job(request: Request, job_id: str, polls: int = 0):
+    job = get_user_job(request, job_id)
+    return render(request, "htmx/songbook_pdf_job.html", {"job": job, "polls": polls})
+
+
+@router.get("/songbook_pdf/job/{job_id}/download", response_class=FileResponse)
+@login_required
+def get_songbook_pdf_job_download(request: Request, job_id: str):
+    job = get_user_job(request, job_id)
+    # a newer build of the same songbook may have collected this PDF
+    if job["status"] != "done" or not Path(job["pdf_path"]).exists():
+        raise HTTPException(status_code=404)
+    return pdf_response(request, job["pdf_path"], job.get("title"))
 
 
 @router.get("/songbook/{songbook_id}", response_class=HTMLResponse)
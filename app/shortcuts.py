@@ -3,11 +3,37 @@ from fastapi.responses import RedirectResponse
 from fastapi.templating import Jinja2Templates
 
 from app import config
+from app.artifacts import artifact_url
 
 settings = config.get_settings()
 templates = Jinja2Templates(directory=str(settings.templates_dir))
 
 
+def preview_srcset(base_name, extension):
+    """srcset of the scaled previews written by app.utils.preview_variants()."""
+    return ", ".join(
+        f"{artifact_url(f'{base_name}.w{width}.{extension}')} {width}w"
+        for width in settings.preview_widths
+    )
+
+
+templates.env.globals["preview_format"] = settings.preview_format
+templates.env.globals[
+    "preview_sizes"
+] = f"(max-width: 576px) 100vw, {max(settings.preview_widths, default=720)}px"
+templates.env.globals["preview_srcset"] = preview_srcset
+templates.env.globals["artifact_url"] = artifact_url
+
+
+def not_modified(request, etag):
+    """Whether the request's If-None-Match already names `etag`."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
 def redirect(path, cookies: dict = {}, remove_session=False):
     response = RedirectResponse(path, status_code=302)
     for k, v in cookies.items():
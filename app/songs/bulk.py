@@ -0,0 +1,440 @@
+import csv
+import hashlib
+import io
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
+from sqlmodel import select
+from sqlmodel import Session
+
+from .importer import update_metadata
+from .models import Song
+from .models import SourceStats
+from .resolver import chunks
+from .resolver import NaturalKeyResolver
+from .resolver import split_name
+from app import config
+from app import db
+from app.utils import build_all_songs
+from app.utils import build_songs
+
+settings = config.get_settings()
+
+SONG_COLUMNS = [column.name for column in Song.__table__.columns]
+SONG_FILES = ["metadata.json", "source.lytex", "verses"]
+LIBRARY_FILES = ["library.json", "source.json"]
+
+
+class PhaseTimer:
+    """Wall clock time spent in each named phase of an import."""
+
+    def __init__(self):
+        self.phases = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def summary(self):
+        lines = [f"{name:<8} {seconds:8.2f}s" for name, seconds in self.phases.items()]
+        lines.append(f"{'total':<8} {sum(self.phases.values()):8.2f}s")
+        return "\n".join(lines)
+
+
+def load_manifest(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, json.decoder.JSONDecodeError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+
+def song_stamp(song_path):
+    """mtimes and sizes of the files of a song directory, without opening them."""
+    stamp = []
+    for name in SONG_FILES:
+        try:
+            stat = (song_path / name).stat()
+            stamp.append([name, stat.st_mtime_ns, stat.st_size])
+        except FileNotFoundError:
+            stamp.append([name, None, None])
+    return stamp
+
+
+def song_hash(song):
+    return hashlib.sha256(json.dumps(song, sort_keys=True).encode()).hexdigest()
+
+
+def read_song(meta_path):
+    """Return `(meta, lytex, verses)` of the song directory of `meta_path`."""
+    with open(meta_path, "r") as meta_source:
+        try:
+            meta = json.load(meta_source)
+        except json.decoder.JSONDecodeError as e:
+            print(f"\033[32mBad song at {meta_path}: {e}\033[0m")
+            return None
+
+    lytex_path = meta_path.parent / "source.lytex"
+    lytex_source = lytex_path.read_text() if lytex_path.exists() else None
+    verses_path = meta_path.parent / "verses"
+    verses_source = verses_path.read_text() if verses_path.exists() else None
+    return meta, lytex_source, verses_source
+
+
+class LibraryIndex:
+    """
+    Songs of the database by id, persons and sources by natural key, so an
+    import never scans a table per song.
+
+    Given `song_ids`, only those songs are loaded up front, the songs of each
+    batch are looked up by `load_songs()` and persons and sources as songs
+    name them. Meant for imports of a few songs of a large library.
+    """
+
+    def __init__(self, session, song_ids=None):
+        self.session = session
+        self.complete = song_ids is None
+        self.songs = {}
+        if self.complete:
+            self.songs = {str(song.id): song for song in session.exec(select(Song))}
+        else:
+            self.load_songs(song_ids)
+        self.resolver = NaturalKeyResolver(session, preload=self.complete)
+
+    def load_songs(self, song_ids):
+        """Index the songs of `song_ids` not indexed yet, unless all are."""
+        if self.complete:
+            return
+        missing = [
+            uuid.UUID(song_id) for song_id in set(song_ids) if song_id not in self.songs
+        ]
+        for chunk in chunks(missing):
+            for song in self.session.exec(select(Song).where(Song.id.in_(chunk))):
+                self.songs[str(song.id)] = song
+
+    def load_library(self, root, paths=None):
+        """
+        Resolve the persons and sources described in `root`'s library files,
+        or only in the library files of `paths`.
+        """
+        if paths is None:
+            paths = [root / "library.json", *root.glob("**/source.json")]
+        persons = []
+        sources = []
+        for path in paths:
+            path = Path(path)
+            if not path.exists():
+                continue
+            with open(path, "r") as library_file:
+                data = json.load(library_file)
+            if path.name == "library.json":
+                persons += data.get("authors", [])
+                sources += data.get("sources", [])
+            else:
+                sources.append(data)
+        self.resolver.persons(persons)
+        self.resolver.sources(sources)
+
+    def resolve(self, songs):
+        """Resolve the persons and sources named by `songs` together."""
+        persons = []
+        for meta, _, _ in songs:
+            if meta.get("recorded_by"):
+                name, surname = split_name(meta["recorded_by"])
+                persons.append({"name": name, "surname": surname})
+        self.resolver.persons(persons)
+        self.resolver.sources([meta["source"] for meta, _, _ in songs])
+
+
+def new_song(index, meta, lytex_source, verses_source):
+    meta = meta.copy()
+    source = index.resolver.source(meta.pop("source"))
+    recorded_by = meta.pop("recorded_by", None)
+    if recorded_by:
+        recorded_by = index.resolver.person(*split_name(recorded_by))
+    meta.pop("recorded_person", None)
+    song = Song.from_dict(
+        meta,
+        source=source,
+        lytex=lytex_source,
+        verses=verses_source,
+        recorded_by=recorded_by,
+    )
+    # relationships are only turned into ids on flush, COPY needs them now
+    song.source_id = source.id
+    song.recorded_by_id = recorded_by.id if recorded_by else None
+    return song
+
+
+def changed_song(song, meta, lytex_source, verses_source):
+    song, updated = update_metadata(song, meta)
+    if lytex_source and song.lytex != lytex_source:
+        song.lytex = lytex_source
+        updated = True
+    if verses_source and song.verses != verses_source:
+        song.verses = verses_source
+        updated = True
+    return updated
+
+
+def copy_songs(session, songs):
+    """Insert `songs` with a single PostgreSQL COPY."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for song in songs:
+        values = (getattr(song, column) for column in SONG_COLUMNS)
+        writer.writerow([r"\N" if value is None else value for value in values])
+    buffer.seek(0)
+    columns = ", ".join(SONG_COLUMNS)
+    cursor = session.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY song ({columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer
+    )
+
+
+def scan_song(meta_path, manifest, song_ids):
+    """
+    Return `(key, entry, song)` for the song directory of `meta_path`.
+
+    `entry` is its new manifest entry, `song` is None when the manifest shows
+    it unchanged since the last import. Returns None for unreadable songs.
+    """
+    key = str(meta_path.parent.resolve())
+    stamp = song_stamp(meta_path.parent)
+    entry = manifest.get(key)
+    # songs deleted from the database are imported again
+    if entry and entry["id"] not in song_ids:
+        entry = None
+    if entry and entry["stamp"] == stamp:
+        return key, entry, None
+    song = read_song(meta_path)
+    if song is None:
+        return None
+    new_entry = {"id": str(song[0]["id"]), "stamp": stamp, "hash": song_hash(song)}
+    if entry and entry["hash"] == new_entry["hash"]:
+        return key, new_entry, None
+    return key, new_entry, song
+
+
+def scan_library(meta_paths, scan, results, stopped, workers):
+    """
+    Put `scan(meta_path)` of every path of `meta_paths` on the `results`
+    queue, then None.
+
+    Songs are read and parsed on `workers` threads. `results` is bounded and
+    at most twice `workers` songs are read ahead of it, so a scan of a large
+    library waits for the database writer instead of filling memory. Setting
+    `stopped` abandons the scan.
+    """
+
+    def put(item):
+        while not stopped.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    slots = threading.BoundedSemaphore(2 * workers)
+
+    def task(meta_path):
+        try:
+            result = scan(meta_path)
+            if result:
+                put(result)
+        except Exception as e:
+            print(f"Couldn't read song at {meta_path}: {e}")
+        finally:
+            slots.release()
+
+    try:
+        with ThreadPoolExecutor(workers, thread_name_prefix="import-scan") as executor:
+            for meta_path in meta_paths:
+                slots.acquire()
+                if stopped.is_set():
+                    break
+                executor.submit(task, meta_path)
+    finally:
+        put(None)
+
+
+def bulk_import(
+    root,
+    batch_size=None,
+    copy=False,
+    build=True,
+    full=False,
+    song_paths=None,
+    build_workers=None,
+    library_paths=None,
+):
+    """
+    Import every song under `root`, creating or updating database rows.
+    Given `song_paths`, only those song directories are imported and only
+    the songs they changed are built, on up to `build_workers` threads.
+    Only the library files of `library_paths` are loaded then, and only the
+    rows these songs touch are indexed.
+
+    Existing rows are indexed up front. Songs are read and parsed on
+    IMPORT_WORKERS threads while this thread writes them in batches of
+    `batch_size`, one commit per batch. With `copy` new songs are loaded with
+    PostgreSQL COPY, meant for the initial load of an empty library. Previews
+    of changed songs are built at the end.
+
+    Song directories whose files kept their mtimes and sizes since the last
+    import, or whose content hashes the same, are skipped unless `full` is
+    set. Returns the numbers of created, updated and skipped songs.
+    """
+    root = Path(root)
+    batch_size = batch_size or settings.import_batch_size
+    timer = PhaseTimer()
+    manifest = load_manifest(settings.import_manifest_path)
+    seen = {}
+    changed = []
+    created = 0
+    updated = 0
+    skipped = 0
+
+    # without expire_on_commit every batch would reload the indexed rows
+    with Session(db.engine, expire_on_commit=False) as session:
+        with timer.phase("index"):
+            if song_paths is None:
+                index = LibraryIndex(session)
+            else:
+                # songs deleted from the database must show up as such to
+                # scan_song(), the manifest knows the ids of the imported ones
+                keys = (str(Path(path).resolve()) for path in song_paths)
+                index = LibraryIndex(
+                    session, [manifest[key]["id"] for key in keys if key in manifest]
+                )
+        if song_paths is None or library_paths:
+            with timer.phase("resolve"):
+                index.load_library(root, None if song_paths is None else library_paths)
+                session.commit()
+
+        def write(songs):
+            nonlocal created, updated, skipped
+            with timer.phase("index"):
+                index.load_songs([str(meta["id"]) for meta, _, _ in songs])
+            with timer.phase("resolve"):
+                index.resolve(songs)
+            with timer.phase("write"):
+                new_songs = []
+                for meta, lytex_source, verses_source in songs:
+                    song = index.songs.get(str(meta["id"]))
+                    if song is None:
+                        song = new_song(index, meta, lytex_source, verses_source)
+                        index.songs[str(meta["id"])] = song
+                        new_songs.append(song)
+                    elif changed_song(song, meta, lytex_source, verses_source):
+                        changed.append(song)
+                        updated += 1
+                    else:
+                        skipped += 1
+                if not copy:
+                    session.add_all(new_songs)
+                session.commit()
+            if copy and new_songs:
+                with timer.phase("copy"):
+                    if session.get_bind().dialect.name == "postgresql":
+                        copy_songs(session, new_songs)
+                        # COPY bypasses the flush that refreshes source stats
+                        SourceStats.refresh(
+                            session.connection(),
+                            {song.source_id for song in new_songs},
+                        )
+                    else:
+                        print("COPY needs PostgreSQL, inserting instead")
+                        session.add_all(new_songs)
+                    session.commit()
+            created += len(new_songs)
+            changed.extend(new_songs)
+
+        if song_paths is None:
+            meta_paths = root.glob("**/metadata.json")
+        else:
+            meta_paths = [
+                Path(path) / "metadata.json"
+                for path in song_paths
+                if (Path(path) / "metadata.json").exists()
+            ]
+
+        # the scan reads and parses songs while this thread writes them
+        results = queue.Queue(maxsize=batch_size)
+        stopped = threading.Event()
+        scanner = threading.Thread(
+            target=scan_library,
+            args=(
+                meta_paths,
+                lambda meta_path: scan_song(
+                    meta_path, {} if full else manifest, index.songs
+                ),
+                results,
+                stopped,
+                settings.import_workers,
+            ),
+            name="import-scan",
+            daemon=True,
+        )
+        scanner.start()
+        try:
+            batch = []
+            while True:
+                with timer.phase("wait"):
+                    result = results.get()
+                if result is None:
+                    break
+                key, entry, song = result
+                seen[key] = entry
+                if song is None:
+                    skipped += 1
+                    continue
+                batch.append(song)
+                if len(batch) >= batch_size:
+                    write(batch)
+                    batch = []
+            if batch:
+                write(batch)
+        finally:
+            stopped.set()
+            scanner.join()
+
+    # directories gone from under root are dropped, other roots are kept
+    if song_paths is None:
+        prefix = str(root.resolve()) + os.sep
+        manifest = {k: v for k, v in manifest.items() if not k.startswith(prefix)}
+    else:
+        gone = {str(Path(path).resolve()) for path in song_paths}
+        manifest = {k: v for k, v in manifest.items() if k not in gone}
+    save_manifest(settings.import_manifest_path, {**manifest, **seen})
+
+    if build:
+        with timer.phase("build"):
+            if song_paths is None:
+                build_all_songs(build_workers)
+            else:
+                # run inside the server, forking a process pool there is unsafe
+                build_songs(changed, build_workers, processes=False)
+
+    print(f"{created} songs created, {updated} updated, {skipped} skipped")
+    print(timer.summary())
+    return created, updated, skipped
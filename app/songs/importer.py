@@ -1,15 +1,16 @@
 import json
 from pathlib import Path
 
-from sqlalchemy.exc import NoResultFound
 from sqlmodel import create_engine
 from sqlmodel import select
 from sqlmodel import Session
 from sqlmodel import SQLModel
 
-from .models import Person
+import app.users.models  # noqa: F401, songedit.user_id references its table
 from .models import Song
 from .models import Source
+from .resolver import NaturalKeyResolver
+from .resolver import split_name
 from app.config import get_settings
 from app.utils import build_song
 
@@ -34,22 +35,12 @@ def reformat_meta(metadata):
     return transformed_metadata
 
 
-def make_entry(session, meta_orig, lytex_source, verses_source):
+def make_entry(session, meta_orig, lytex_source, verses_source, resolver=None):
     meta = meta_orig.copy()
-    source = session.exec(
-        select(Source).where(Source.title == meta["source"]["title"])
-    ).one()
+    resolver = resolver or NaturalKeyResolver(session)
+    source = resolver.source(meta["source"])
     if "recorded_by" in meta.keys():
-        name, surname = meta["recorded_by"].split(" ")
-        try:
-            recorded_by = session.exec(
-                select(Person)
-                .where(Person.name == name)
-                .where(Person.surname == surname)
-            ).one()
-        except NoResultFound:
-            recorded_by = Person(name=name, surname=surname)
-            session.add(recorded_by)
+        recorded_by = resolver.person(*split_name(meta["recorded_by"]))
     else:
         recorded_by = None
     #            recorded_person = find_person_by_dict(person_list, meta["recorded_person"])
@@ -70,9 +61,12 @@ def make_entry(session, meta_orig, lytex_source, verses_source):
 
 
 def update_metadata(song, meta):
-    # Remove nested dictionaries
+    # Keep plain columns only, the id never changes and relationships like
+    # recorded_by are given as names, they would always compare unequal
     clean_data = {
-        key: value for key, value in meta.items() if not isinstance(value, dict)
+        key: value
+        for key, value in meta.items()
+        if key in Song.__table__.columns and key != "id"
     }
 
     # Update only top-level attributes
@@ -98,13 +92,6 @@ def update_metadata(song, meta):
 #            song.
 
 
-def find_song_by_id(db_songs_ids, target_id):
-    for song_id, song in db_songs_ids:
-        if song_id == target_id:
-            return song
-    return None  # Return None if no matching song is found
-
-
 def update_song(path, force_rebuild=False):
     with open(path / "metadata.json", "r") as meta_source:
         try:
@@ -144,7 +131,7 @@ def update_song(path, force_rebuild=False):
             build_song(song, force=True)
 
 
-def process_song(meta_path, db_songs, db_songs_ids, session):
+def process_song(meta_path, db_songs, session, resolver):
     print(f"\033[32mOpening file {meta_path}\033[0m")
     with open(meta_path, "r") as meta_source:
         try:
@@ -164,10 +151,10 @@ def process_song(meta_path, db_songs, db_songs_ids, session):
         verses_source = verses_path.read_text()
     else:
         verses_source = None
-    song = find_song_by_id(db_songs_ids, meta["id"])
+    song = db_songs.get(str(meta["id"]))
 
     if song is None:
-        song = make_entry(session, meta, lytex_source, verses_source)
+        song = make_entry(session, meta, lytex_source, verses_source, resolver)
     else:
         song, updated = update_metadata(song, meta)
         if updated:
@@ -181,40 +168,6 @@ def process_song(meta_path, db_songs, db_songs_ids, session):
             session.commit()
 
 
-def obj_in_db(cls, cls_dict):
-    with Session(engine) as session:
-        objects = session.exec(select(cls)).all()
-    for obj in objects:
-        db_dict = obj.dict()
-        del db_dict["id"]
-        common_keys = set(db_dict.keys()).intersection(cls_dict.keys())
-        match = all(
-            cls_dict.get(key) == db_dict[key] or db_dict[key] is None
-            for key in common_keys
-        )
-        if match:
-            return obj
-    return False
-
-
-def add_person(person_dict):
-    person = Person.from_dict(person_dict)
-    with Session(engine) as session:
-        session.add(person)
-        session.commit()
-
-
-def add_source(source_dict):
-    with Session(engine) as session:
-        name, surname = source_dict["author_name"].split(" ")
-        person = session.exec(
-            select(Person).where(Person.name == name).where(Person.surname == surname)
-        ).one()
-        source = Source.from_dict(source_dict, author=person)
-        session.add(source)
-        session.commit()
-
-
 def import_folder(folder_path):
     if isinstance(folder_path, Path):
         root = folder_path
@@ -234,6 +187,11 @@ def import_folder(folder_path):
             if source_id
             else None
         )
+        if existing is None:
+            # titles are unique, a source.json without id updates its source
+            existing = session.exec(
+                select(Source).where(Source.title == metadata.get("title"))
+            ).first()
         source = Source.from_dict(metadata, session, existing_source=existing)
         session.add(source)
         session.commit()
@@ -259,24 +217,19 @@ def import_library(source_path):
             print(e)
             return 0
 
-    for author in library["authors"]:
-        if not obj_in_db(Person, author):
-            add_person(author)
-
-    for source in library["sources"]:
-        if not obj_in_db(Source, source):
-            add_source(source)
-
     fs_songs = root.glob("**/metadata.json")
 
     with Session(engine) as session:
+        resolver = NaturalKeyResolver(session)
+        resolver.persons(library["authors"])
+        resolver.sources(library["sources"])
+        session.commit()
         try:
-            db_songs = session.exec(select(Song)).all()
-            db_songs_ids = [(str(db_song.id), db_song) for db_song in db_songs]
+            db_songs = {str(song.id): song for song in session.exec(select(Song))}
         except Exception as e:
             print(f"Couldn't get songs from database: {e}")
         for song in fs_songs:
-            process_song(song, db_songs, db_songs_ids, session)
+            process_song(song, db_songs, session, resolver)
 
 
 if __name__ == "__main__":
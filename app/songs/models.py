@@ -1,12 +1,21 @@
 import uuid
 from datetime import datetime
+from itertools import chain
 from typing import List
 from typing import Optional
 
+from sqlalchemy import distinct
+from sqlalchemy import event
+from sqlalchemy import func
+from sqlalchemy import Index
+from sqlalchemy import inspect
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlmodel import Enum
 from sqlmodel import Field
 from sqlmodel import Relationship
-from sqlmodel import select
 from sqlmodel import Session
 from sqlmodel import SQLModel
 
@@ -26,6 +35,9 @@ class SourceType(str, Enum):
 
 # --- Person model ---
 class Person(SQLModel, table=True):
+    # natural key the importer resolves persons by
+    __table_args__ = (Index("ix_person_name_surname", "name", "surname", unique=True),)
+
     id: Optional[uuid.UUID] = Field(
         default_factory=uuid.uuid4, primary_key=True, index=True
     )
@@ -55,6 +67,8 @@ class Person(SQLModel, table=True):
 
 # --- Source model ---
 class Source(SQLModel, table=True):
+    __table_args__ = (Index("ix_source_title", "title", unique=True),)
+
     id: Optional[uuid.UUID] = Field(
         default_factory=uuid.uuid4, primary_key=True, index=True
     )
@@ -81,11 +95,13 @@ class Source(SQLModel, table=True):
         data: dict,
         session: Optional[Session] = None,
         existing_source: "Source" = None,
+        resolver=None,
     ) -> "Source":
         """
         Create or update a Source from a metadata dict.
         - `existing_source`: if provided, updates that Source, otherwise creates new.
         - `data`: expects keys like 'title', 'type', 'transcribed_by', 'public', 'authors' (list of names)
+        - `resolver`: NaturalKeyResolver to reuse across calls, authors are resolved with it
         """
         source = existing_source or cls()
 
@@ -98,28 +114,41 @@ class Source(SQLModel, table=True):
         # Handle authors list
         authors_names: List[str] = data.get("authors", [])
         if session:
-            from .models import Person  # avoid circular imports
-
-            source.authors = []  # reset authors
-            for name in authors_names:
-                # split name into first/last (naive)
-                parts = name.strip().split(maxsplit=1)
-                first = parts[0]
-                last = parts[1] if len(parts) > 1 else None
-                # find or create Person
-                person = session.exec(
-                    select(Person).where(Person.name == first, Person.surname == last)
-                ).first()
-                if not person:
-                    person = Person(name=first, surname=last)
-                    session.add(person)
-                    session.commit()
-                source.authors.append(person)
+            from .resolver import NaturalKeyResolver  # avoid circular imports
+            from .resolver import split_name
+
+            resolver = resolver or NaturalKeyResolver(session)
+            # find or create every author at once
+            authors = resolver.persons(
+                [
+                    dict(zip(("name", "surname"), split_name(name)))
+                    for name in authors_names
+                ]
+            )
+            source.authors = list(authors.values())  # reset authors
 
         return source
 
 
 class Song(SQLModel, table=True):
+    # listing order of app.songs.pagination.song_order() within a source
+    __table_args__ = (
+        Index(
+            "ix_song_source_order",
+            "source_id",
+            text("(signature IS NULL)"),
+            text("coalesce(signature, '')"),
+            text("(number IS NULL)"),
+            text("coalesce(number, -1)"),
+            text("(page IS NULL)"),
+            text("coalesce(page, -1)"),
+            "id",
+        ),
+        # IN filters of a source's songs by location and signature
+        Index("ix_song_source_location", "source_id", "location"),
+        Index("ix_song_source_signature", "source_id", "signature"),
+    )
+
     id: Optional[uuid.UUID] = Field(
         default_factory=uuid.uuid4, primary_key=True, index=True
     )
@@ -137,7 +166,9 @@ class Song(SQLModel, table=True):
     location: Optional[str]
     transcribed_by: Optional[str] = None
 
-    recorded_by_id: Optional[uuid.UUID] = Field(default=None, foreign_key="person.id")
+    recorded_by_id: Optional[uuid.UUID] = Field(
+        default=None, foreign_key="person.id", index=True
+    )
     recorded_by: Optional["Person"] = Relationship(
         sa_relationship_kwargs={
             "primaryjoin": "Song.recorded_by_id==Person.id",
@@ -165,6 +196,84 @@ class Song(SQLModel, table=True):
         return f"Song(title={self.title})"
 
 
+class SourceStats(SQLModel, table=True):
+    """Per source song statistics, so listing sources never touches songs."""
+
+    source_id: uuid.UUID = Field(
+        foreign_key="source.id", primary_key=True, ondelete="CASCADE"
+    )
+    song_count: int = Field(default=0, nullable=False)
+    location_count: int = Field(default=0, nullable=False)
+    year_min: Optional[int] = None
+    year_max: Optional[int] = None
+    updated: Optional[datetime] = None
+
+    def __repr__(self):
+        return f"SourceStats(source_id={self.source_id}, songs={self.song_count})"
+
+    @classmethod
+    def refresh(cls, connection, source_ids=None):
+        """Recompute the stats of the sources `source_ids`, or of all of them."""
+        song = Song.__table__
+        stats = cls.__table__
+        condition = song.c.source_id.isnot(None)
+        if source_ids is not None:
+            source_ids = [uuid.UUID(str(source_id)) for source_id in source_ids]
+            condition = song.c.source_id.in_(source_ids)
+        query = (
+            select(
+                song.c.source_id,
+                func.count(),
+                func.count(distinct(song.c.location)),
+                func.min(song.c.year),
+                func.max(song.c.year),
+                func.current_timestamp(),
+            )
+            .where(condition)
+            .group_by(song.c.source_id)
+        )
+        columns = [
+            "source_id",
+            "song_count",
+            "location_count",
+            "year_min",
+            "year_max",
+            "updated",
+        ]
+        if connection.dialect.name == "postgresql":
+            insert = postgresql_insert(stats)
+        else:
+            insert = sqlite_insert(stats)
+        insert = insert.from_select(columns, query)
+        connection.execute(
+            insert.on_conflict_do_update(
+                index_elements=["source_id"],
+                set_={column: insert.excluded[column] for column in columns[1:]},
+            )
+        )
+
+        # sources left without songs
+        delete = stats.delete().where(
+            stats.c.source_id.not_in(select(song.c.source_id).where(condition))
+        )
+        if source_ids is not None:
+            delete = delete.where(stats.c.source_id.in_(source_ids))
+        connection.execute(delete)
+
+
+@event.listens_for(Session, "after_flush")
+def refresh_source_stats(session, flush_context):
+    # sources of songs written by this flush, before and after a move
+    source_ids = set()
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Song):
+            history = inspect(obj).attrs.source_id.history
+            source_ids.update(history.sum())
+    source_ids.discard(None)
+    if source_ids:
+        SourceStats.refresh(session.connection(), source_ids)
+
+
 class SongEdit(SQLModel, table=True):
     id: Optional[uuid.UUID] = Field(
         default_factory=uuid.uuid4, primary_key=True, index=True
@@ -0,0 +1,84 @@
+import base64
+import binascii
+import json
+import uuid
+
+from sqlalchemy import func
+from sqlalchemy import literal_column
+from sqlalchemy import tuple_
+
+from .models import Song
+
+PAGE_SIZE = 10
+
+
+# nullable columns of the listing order, each with the value standing in for NULL
+ORDER_COLUMNS = [("signature", ""), ("number", -1), ("page", -1)]
+
+
+def song_order():
+    """
+    Listing order of songs, matching the `ix_song_source_order` index:
+    signature, number and page, NULLs last, then id.
+
+    Each nullable column sorts by whether it is NULL first, then by its value
+    with NULL replaced, so row comparisons against a cursor stay true or
+    false. The defaults are literals, the planner only matches the index
+    expressions then.
+    """
+    order = []
+    for name, default in ORDER_COLUMNS:
+        column = getattr(Song, name)
+        order += [
+            column.is_(None),
+            func.coalesce(column, literal_column(repr(default))),
+        ]
+    return (*order, Song.id)
+
+
+def song_key(song):
+    key = []
+    for name, default in ORDER_COLUMNS:
+        value = getattr(song, name)
+        key += [value is None, default if value is None else value]
+    return (*key, str(song.id))
+
+
+def encode_cursor(song):
+    """Opaque cursor of the songs listed after `song`."""
+    data = json.dumps(song_key(song), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Return the song key of `cursor`, raise ValueError for a malformed one."""
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        *key, song_id = json.loads(data)
+        if len(key) != 2 * len(ORDER_COLUMNS) or not isinstance(song_id, str):
+            raise ValueError(f"Bad cursor {cursor}")
+        for (_, default), is_null, value in zip(ORDER_COLUMNS, key[::2], key[1::2]):
+            if not (isinstance(is_null, bool) and type(value) is type(default)):
+                raise ValueError(f"Bad cursor {cursor}")
+        return (*key, uuid.UUID(song_id))
+    except (binascii.Error, UnicodeDecodeError, TypeError) as e:
+        raise ValueError(f"Bad cursor {cursor}") from e
+
+
+def keyset_page(session, statement, cursor=None, size=PAGE_SIZE):
+    """
+    Return `(songs, next_cursor)`, the `size` songs of the song `statement`
+    following `cursor`. `next_cursor` is None on the last page.
+
+    Rows are found by comparing the listing order against the cursor's song
+    instead of skipping an OFFSET, so deep pages cost the same as the first
+    and songs imported meanwhile neither repeat nor get skipped.
+    """
+    order = song_order()
+    if cursor:
+        statement = statement.where(tuple_(*order) > tuple_(*decode_cursor(cursor)))
+    songs = session.exec(statement.order_by(*order).limit(size + 1)).all()
+    if len(songs) <= size:
+        return songs, None
+    songs = songs[:size]
+    return songs, encode_cursor(songs[-1])
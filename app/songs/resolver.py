@@ -0,0 +1,176 @@
+import uuid
+
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import select
+
+from .models import Person
+from .models import Source
+from .models import SourceAuthorLink
+
+# rows per INSERT statement
+CHUNK_SIZE = 1000
+
+
+def split_name(full_name):
+    parts = full_name.strip().split(maxsplit=1)
+    return parts[0], parts[1] if len(parts) > 1 else None
+
+
+def person_key(name, surname):
+    # surname is not nullable, single word names are stored with an empty one
+    return name, surname or ""
+
+
+def author_names(source_data):
+    names = list(source_data.get("authors", []))
+    if source_data.get("author_name"):
+        names.append(source_data["author_name"])
+    return names
+
+
+def chunks(rows):
+    for start in range(0, len(rows), CHUNK_SIZE):
+        yield rows[start : start + CHUNK_SIZE]
+
+
+class NaturalKeyResolver:
+    """
+    Persons by (name, surname) and sources by title.
+
+    Each table is loaded into a dict once, on first use. Without `preload`
+    only the rows asked for are looked up, meant for imports of a few songs.
+    Rows missing from the database are created together with INSERT ... ON
+    CONFLICT DO NOTHING against the unique natural key indexes, so a
+    concurrent import creating the same person or source is picked up
+    instead of duplicated.
+    """
+
+    def __init__(self, session, preload=True):
+        self.session = session
+        self.preload = preload
+        self._persons = None
+        self._sources = None
+
+    def __repr__(self):
+        return f"NaturalKeyResolver(session={self.session})"
+
+    def insert(self, model):
+        if self.session.get_bind().dialect.name == "postgresql":
+            return postgresql_insert(model)
+        return sqlite_insert(model)
+
+    def insert_missing(self, model, rows):
+        columns = [column.name for column in model.__table__.columns]
+        rows = [{column: row.get(column) for column in columns} for row in rows]
+        for chunk in chunks(rows):
+            self.session.execute(
+                self.insert(model).values(chunk).on_conflict_do_nothing()
+            )
+
+    def person_index(self):
+        if self._persons is None:
+            self._persons = {}
+            if self.preload:
+                self._persons = {
+                    person_key(person.name, person.surname): person
+                    for person in self.session.exec(select(Person))
+                }
+        return self._persons
+
+    def source_index(self):
+        if self._sources is None:
+            self._sources = {}
+            if self.preload:
+                self._sources = {
+                    source.title: source for source in self.session.exec(select(Source))
+                }
+        return self._sources
+
+    def load_persons(self, keys):
+        """Index the persons of the `(name, surname)` keys found in the database."""
+        index = self.person_index()
+        for chunk in chunks(list(keys)):
+            for person in self.session.exec(
+                select(Person).where(tuple_(Person.name, Person.surname).in_(chunk))
+            ):
+                index[person_key(person.name, person.surname)] = person
+
+    def load_sources(self, titles):
+        """Index the sources of `titles` found in the database and return them."""
+        index = self.source_index()
+        sources = []
+        for chunk in chunks(list(titles)):
+            for source in self.session.exec(
+                select(Source).where(Source.title.in_(chunk))
+            ):
+                index[source.title] = source
+                sources.append(source)
+        return sources
+
+    def persons(self, rows):
+        """
+        Return `{(name, surname): Person}` for the person dicts `rows`, creating
+        the missing ones. Dicts need `name` and may carry other Person fields.
+        """
+        index = self.person_index()
+        keys = [person_key(row["name"], row.get("surname")) for row in rows]
+        if not self.preload:
+            self.load_persons({key for key in keys if key not in index})
+        missing = {}
+        for key, row in zip(keys, rows):
+            if key not in index and key not in missing:
+                missing[key] = {"id": uuid.uuid4(), **row, "surname": key[1]}
+        if missing:
+            self.insert_missing(Person, list(missing.values()))
+            # rows created meanwhile by someone else come back with their ids
+            self.load_persons(missing)
+        return {key: index[key] for key in keys}
+
+    def person(self, name, surname=None):
+        return self.persons([{"name": name, "surname": surname}])[
+            person_key(name, surname)
+        ]
+
+    def sources(self, rows):
+        """
+        Return `{title: Source}` for the source dicts `rows`, creating the
+        missing ones along with their authors, given by name in `authors` or
+        `author_name`. Existing sources are returned as they are.
+        """
+        index = self.source_index()
+        if not self.preload:
+            self.load_sources({row["title"] for row in rows} - index.keys())
+        missing = {}
+        for row in rows:
+            if row["title"] not in index and row["title"] not in missing:
+                missing[row["title"]] = {"id": uuid.uuid4(), "public": False, **row}
+        if missing:
+            authors = self.persons(
+                [
+                    dict(zip(("name", "surname"), split_name(name)))
+                    for row in missing.values()
+                    for name in author_names(row)
+                ]
+            )
+            self.insert_missing(Source, list(missing.values()))
+            created = {
+                source.title
+                for source in self.load_sources(missing)
+                if source.id == missing[source.title]["id"]
+            }
+            links = [
+                {
+                    "source_id": index[title].id,
+                    "person_id": authors[person_key(*split_name(name))].id,
+                }
+                for title in created
+                for name in author_names(missing[title])
+            ]
+            if links:
+                self.insert_missing(SourceAuthorLink, links)
+        return {row["title"]: index[row["title"]] for row in rows}
+
+    def source(self, data):
+        return self.sources([data])[data["title"]]
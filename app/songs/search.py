@@ -0,0 +1,130 @@
+import re
+
+from sqlalchemy import func
+from sqlalchemy import literal_column
+from sqlalchemy import or_
+from sqlalchemy import text
+from sqlalchemy import union
+from sqlmodel import select
+
+from .models import Person
+from .models import Song
+
+PAGE_SIZE = 10
+MAX_QUERY_LENGTH = 200
+
+# maintained by the song_search_vector_update trigger, see the migration
+# adding it, the column is not mapped on Song
+SEARCH_VECTOR = literal_column("song.search_vector")
+
+# indexed search support by database URL
+_indexed = {}
+
+
+def unaccented(expression):
+    """f_unaccent(), the immutable unaccent() the trigram indexes are built on."""
+    return func.f_unaccent(expression)
+
+
+def person_full_name():
+    return Person.name + literal_column("' '") + Person.surname
+
+
+def indexed_search(session):
+    """
+    Whether the database has the search column and functions of the song
+    search migration. SQLite and databases made by create_all don't, they are
+    searched with ILIKE instead.
+    """
+    bind = session.get_bind()
+    if bind.dialect.name != "postgresql":
+        return False
+    key = str(bind.url)
+    if key not in _indexed:
+        _indexed[key] = session.execute(
+            text(
+                "SELECT to_regprocedure('f_unaccent(text)') IS NOT NULL"
+                " AND EXISTS (SELECT 1 FROM information_schema.columns"
+                " WHERE table_name = 'song' AND column_name = 'search_vector')"
+            )
+        ).scalar()
+    return _indexed[key]
+
+
+def contains(column, query):
+    """Case-insensitive substring match of `query` in `column`."""
+    pattern = "%" + re.sub(r"([\\%_])", r"\\\1", query) + "%"
+    return column.ilike(pattern, escape="\\")
+
+
+def title_matches(session, query):
+    """Condition of songs titled like `query`, fuzzily where indexed."""
+    if not indexed_search(session):
+        return contains(Song.title, query)
+    # % is answered by the ix_song_title_trgm index, similarity() then
+    # applies the stricter threshold to its matches only
+    title = unaccented(Song.title)
+    term = unaccented(query)
+    return title.op("%")(term) & (func.similarity(title, term) > 0.5)
+
+
+def search_songs(session, query, page=1, size=PAGE_SIZE):
+    """
+    Return `(songs, more)`, page `page` of the songs matching `query` best.
+
+    Candidates come from the indexes only: full text matches of title,
+    location, recorder and verses, plus trigram matches of title, location
+    and recorder name, so misspelled and unaccented queries still match.
+    They are ranked by full text rank and title similarity. Without the
+    search indexes, songs containing `query` are listed by title.
+    """
+    query = query.strip()[:MAX_QUERY_LENGTH]
+    if not query:
+        return [], False
+    if not indexed_search(session):
+        return plain_search_songs(session, query, page, size)
+    term = unaccented(query)
+    text_query = func.websearch_to_tsquery("simple", term)
+
+    # every branch is answered by its own index, an OR of them is not
+    candidates = union(
+        select(Song.id).where(SEARCH_VECTOR.op("@@")(text_query)),
+        select(Song.id).where(unaccented(Song.title).op("%")(term)),
+        select(Song.id).where(unaccented(Song.location).op("%")(term)),
+        select(Song.id)
+        .join(Person, Song.recorded_by_id == Person.id)
+        .where(unaccented(person_full_name()).op("%")(term)),
+    ).subquery()
+
+    rank = func.ts_rank(SEARCH_VECTOR, text_query) + func.coalesce(
+        func.similarity(unaccented(Song.title), term), 0
+    )
+    statement = (
+        select(Song)
+        .join(candidates, candidates.c.id == Song.id)
+        .order_by(rank.desc(), Song.id)
+        .offset((page - 1) * size)
+        .limit(size + 1)
+    )
+    songs = session.exec(statement).all()
+    return songs[:size], len(songs) > size
+
+
+def plain_search_songs(session, query, page, size):
+    statement = (
+        select(Song)
+        .outerjoin(Person, Song.recorded_by_id == Person.id)
+        .where(
+            or_(
+                contains(Song.title, query),
+                contains(Song.location, query),
+                contains(Song.verses, query),
+                contains(person_full_name(), query),
+            )
+        )
+        .order_by(Song.title, Song.id)
+        .offset((page - 1) * size)
+        .limit(size + 1)
+    )
+    songs = session.exec(statement).all()
+    return songs[:size], len(songs) > size
@@ -0,0 +1,140 @@
+import threading
+import time
+from pathlib import Path
+
+from .bulk import bulk_import
+from .bulk import LIBRARY_FILES
+from app import config
+
+settings = config.get_settings()
+
+
+class ReimportQueue:
+    """
+    Song directories changed on disk, reimported together once changes stop.
+
+    File events only add their song directory to a set, so the hundreds of
+    events of a `git pull` collapse into one entry per song. A worker thread
+    waits until no event arrived for `delay` seconds, or `max_delay` passed
+    since the first one, then imports the whole set as one batch and builds
+    the songs it changed on at most `build_workers` threads. Changed
+    library.json and source.json files are loaded with the batch, the rest of
+    the library is not read again.
+    """
+
+    def __init__(self, root, delay, max_delay, build_workers):
+        self.root = Path(root)
+        self.delay = delay
+        self.max_delay = max_delay
+        self.build_workers = build_workers
+        self.events = 0
+        self.processed = 0
+        self.failed = 0
+        self.batches = 0
+        self.running = 0
+        self.last_batch = None
+        self._pending = set()
+        self._library = set()
+        self._first_event = None
+        self._last_event = None
+        self._changed = threading.Condition()
+        self._thread = None
+
+    def __repr__(self):
+        return f"ReimportQueue(root={self.root}, delay={self.delay})"
+
+    def add(self, path):
+        """Queue the song directory of the changed file or directory `path`."""
+        path = Path(path)
+        if any(part.startswith(".") for part in path.parts):
+            return
+        library_path = path if path.name in LIBRARY_FILES else None
+        if not path.is_dir():
+            path = path.parent
+        with self._changed:
+            if library_path:
+                self._library.add(library_path)
+            self.events += 1
+            now = time.monotonic()
+            if not self._pending:
+                self._first_event = now
+            self._last_event = now
+            self._pending.add(path)
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._loop, name="song-reimport", daemon=True
+                )
+                self._thread.start()
+            self._changed.notify()
+
+    def stats(self):
+        with self._changed:
+            return {
+                "queued": len(self._pending),
+                "running": self.running,
+                "processed": self.processed,
+                "failed": self.failed,
+                "batches": self.batches,
+                "events": self.events,
+                "last_batch": self.last_batch,
+            }
+
+    def _loop(self):
+        while True:
+            with self._changed:
+                while not self._pending:
+                    self._changed.wait()
+                while True:
+                    now = time.monotonic()
+                    remaining = min(
+                        self._last_event + self.delay,
+                        self._first_event + self.max_delay,
+                    )
+                    if remaining <= now:
+                        break
+                    self._changed.wait(remaining - now)
+                paths = self._pending
+                library_paths = self._library
+                self._pending = set()
+                self._library = set()
+
+            # source folders and deleted songs queue directories without a song
+            song_paths = [path for path in paths if (path / "metadata.json").exists()]
+            with self._changed:
+                self.running = len(song_paths)
+
+            start = time.perf_counter()
+            try:
+                # the songs created, updated and skipped, those actually read
+                processed, failed = sum(self.reimport(paths, library_paths)), 0
+            except Exception as e:
+                print(f"Couldn't reimport {len(song_paths)} song directories: {e}")
+                processed, failed = 0, len(song_paths)
+
+            with self._changed:
+                self.running = 0
+                self.processed += processed
+                self.failed += failed
+                self.batches += 1
+                self.last_batch = {
+                    "size": processed + failed,
+                    "seconds": round(time.perf_counter() - start, 2),
+                    "finished": time.strftime("%Y-%m-%d %H:%M:%S"),
+                }
+
+    def reimport(self, paths, library_paths=()):
+        # directories without metadata.json, like a source folder, are skipped
+        return bulk_import(
+            self.root,
+            song_paths=sorted(paths),
+            build_workers=self.build_workers,
+            library_paths=sorted(library_paths),
+        )
+
+
+reimport_queue = ReimportQueue(
+    Path("app/songs/data"),
+    settings.reimport_delay,
+    settings.reimport_max_delay,
+    settings.reimport_build_workers,
+)
@@ -0,0 +1,102 @@
+import threading
+import time
+from pathlib import Path
+
+from sqlalchemy import func
+from sqlalchemy import text
+from sqlmodel import select
+
+from . import config
+from .songs.models import Song
+from .songs.models import SongEdit
+from .songs.models import Source
+from .users.models import User
+
+settings = config.get_settings()
+
+COUNTED = {"users": User, "songs": Song, "sources": Source, "songedits": SongEdit}
+
+
+class AdminStats:
+    """
+    Row counts and data folders shown on the admin dashboard.
+
+    A snapshot is computed at most once per `ttl` seconds. Tables PostgreSQL
+    estimates at `estimate_rows` rows or more are not counted, their
+    pg_class estimate is reported as approximate instead. The folder listing
+    is read again only when the data directory itself changed.
+    """
+
+    def __init__(self, data_path, ttl, estimate_rows):
+        self.data_path = Path(data_path)
+        self.ttl = ttl
+        self.estimate_rows = estimate_rows
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._expires = 0
+        self._folders = None
+        self._folders_mtime = None
+
+    def __repr__(self):
+        return f"AdminStats(data_path={self.data_path}, ttl={self.ttl})"
+
+    def estimate(self, session, model):
+        """pg_class row estimate of `model`'s table, None when unknown."""
+        bind = session.get_bind()
+        if bind.dialect.name != "postgresql":
+            return None
+        name = bind.dialect.identifier_preparer.quote(model.__table__.name)
+        estimate = session.execute(
+            text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:name)"),
+            {"name": name},
+        ).scalar()
+        # -1 until the table is first vacuumed or analyzed
+        if estimate is None or estimate < 0:
+            return None
+        return int(estimate)
+
+    def count(self, session, model):
+        """Return `(rows, approximate)` of `model`'s table."""
+        estimate = self.estimate(session, model)
+        if estimate is not None and estimate >= self.estimate_rows:
+            return estimate, True
+        return session.exec(select(func.count()).select_from(model)).one(), False
+
+    def folders(self):
+        try:
+            mtime = self.data_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return []
+        if mtime != self._folders_mtime:
+            self._folders = [
+                {
+                    "name": f.name,  # what you display in the template
+                    "path": f.resolve(),  # absolute path, for backend actions or HTMX
+                }
+                for f in sorted(self.data_path.iterdir())
+                if f.is_dir() and not f.name.startswith(".")
+            ]
+            self._folders_mtime = mtime
+        return self._folders
+
+    def snapshot(self, session):
+        with self._lock:
+            if self._snapshot is None or time.monotonic() >= self._expires:
+                counts = {}
+                approximate = {}
+                for name, model in COUNTED.items():
+                    counts[name], approximate[name] = self.count(session, model)
+                self._snapshot = {"counts": counts, "approximate": approximate}
+                self._expires = time.monotonic() + self.ttl
+            return {**self._snapshot, "folders": self.folders()}
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+
+admin_stats = AdminStats(
+    Path(__file__).parent / "songs" / "data",
+    settings.admin_stats_ttl,
+    settings.admin_stats_estimate_rows,
+)
@@ -1,15 +1,27 @@
+import hashlib
 import json
-import subprocess
+import time
+from concurrent.futures import as_completed
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from PIL import Image
+from PIL import ImageChops
 from PIL import ImageOps
 from pydantic import BaseModel
 from pydantic.error_wrappers import ValidationError
+from sqlmodel import select
 
+from . import config
 from . import db
+from .press.batch import render_batcher
+from .press.cache import lilypond_version
+from .press.coordinator import coordinator
 from .songs.models import Song
 
+settings = config.get_settings()
+
 
 def valid_schema_data_or_error(raw_data: dict, SchemaModel: BaseModel):
     data = {}
@@ -28,6 +40,16 @@ def valid_schema_data_or_error(raw_data: dict, SchemaModel: BaseModel):
     return data, errors
 
 
+# a channel value maps to 255 in the mask where the pixel is pure black/white
+BLACK_LUT = [255] + [0] * 255
+WHITE_LUT = [0] * 255 + [255]
+
+
+def color_mask(image, lut):
+    red, green, blue = (channel.point(lut) for channel in image.split())
+    return ImageChops.multiply(ImageChops.multiply(red, green), blue)
+
+
 def dark_theme_png(dest_path):
     # Open the inverted PNG image
     image = Image.open(dest_path / "source.cropped.png")
@@ -38,46 +60,196 @@ def dark_theme_png(dest_path):
     dark_gray_color = (33, 37, 41)  # RGB values for #212529
     darker_white_color = (200, 200, 200)  # Adjusted slightly darker shade of white
 
-    # Get the image dimensions
-    width, height = image.size
-
-    # Loop through each pixel in the image
-    for x in range(width):
-        for y in range(height):
-            pixel_color = image.getpixel((x, y))
-
-            # If the pixel color is black, replace it with the dark gray color
-            if pixel_color == (0, 0, 0):
-                image.putpixel((x, y), dark_gray_color)
-            # If the pixel color is white, replace it with the slightly darker white color
-            elif pixel_color == (255, 255, 255):
-                image.putpixel((x, y), darker_white_color)
+    # Only RGB pixels can match the colors, other modes are saved just inverted
+    if image.mode == "RGB":
+        # Masks are computed before painting, so a pixel is never replaced twice
+        black_mask = color_mask(image, BLACK_LUT)
+        white_mask = color_mask(image, WHITE_LUT)
+        image.paste(dark_gray_color, mask=black_mask)
+        image.paste(darker_white_color, mask=white_mask)
 
     # Save the modified image
     image.save(dest_path / "source.cropped.dark.png")
+    preview_variants(image, dest_path, "source.cropped.dark")
+
+
+def preview_variants(image, dest_path, name):
+    """
+    Save `image` as WebP and PNG scaled down to every preview width, for the
+    srcset of the song templates.
+    """
+    for width in settings.preview_widths:
+        variant = image
+        if image.width > width:
+            height = round(image.height * width / image.width)
+            # resampling smears the few engraved colours into hundreds of
+            # greys, which would make the scaled file larger than the original
+            variant = image.resize((width, height), Image.LANCZOS).quantize(16)
+        variant.save(dest_path / f"{name}.w{width}.webp", lossless=True)
+        variant.save(dest_path / f"{name}.w{width}.png", optimize=True)
+
+
+def preview_names(dark_theme=True):
+    """Names of the files derive_previews() writes next to source.cropped.png."""
+    names = []
+    for name in ["source.cropped", "source.cropped.dark"][: 1 + dark_theme]:
+        for width in settings.preview_widths:
+            names += [f"{name}.w{width}.webp", f"{name}.w{width}.png"]
+    if dark_theme:
+        names.append("source.cropped.dark.png")
+    return names
+
+
+def derive_previews(dest_path, dark_theme=True):
+    image = Image.open(dest_path / "source.cropped.png")
+    preview_variants(image, dest_path, "source.cropped")
+    if dark_theme:
+        dark_theme_png(dest_path)
+
+
+def derive_all_previews(dest_paths, workers=None, processes=True):
+    """
+    Run derive_previews() over many song directories on a process pool, or
+    on threads without `processes`, where forking is unsafe.
+    """
+    pool = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    with pool(max_workers=workers) as executor:
+        for dest_path, error in zip(
+            dest_paths, executor.map(try_derive_previews, dest_paths)
+        ):
+            if error:
+                print(f"Couldn't convert {dest_path}: {error}")
+
+
+def try_derive_previews(dest_path):
+    try:
+        derive_previews(dest_path)
+    except Exception as e:
+        return str(e)
+    return None
 
 
-def build_song(song, force=False):
-    dest_path = Path("app/tmp/" + str(song.id))
-    pdf_path = dest_path / "source.pdf"
-    if pdf_path.exists() and not force:
-        return
-    dest_path.mkdir(parents=True, exist_ok=True)
-    source = dest_path / "source.lytex"
+def song_source(song):
+    return "#(ly:set-option 'crop #t)\n" + song.lytex
+
+
+def source_hash(source):
+    digest = hashlib.sha256()
+    digest.update(lilypond_version().encode())
+    digest.update(b"\0")
+    digest.update(settings.preview_format.encode())
+    digest.update(b"\0")
+    digest.update(source.encode())
+    return digest.hexdigest()
 
-    with source.open(mode="w") as file:
-        source_lytex = "#(ly:set-option 'crop #t)\n" + song.lytex
-        file.write(source_lytex)
 
-    subprocess.run(["lilypond", "-o", dest_path.resolve(), source.resolve()])
+def is_built(dest_path, digest):
+    """
+    Whether `dest_path` holds a complete build of the source hashed as `digest`.
 
-    dark_theme_png(dest_path)
-    return
+    The hash is recorded in the build manifest entry `source.sha256`, written
+    only after lilypond succeeded, so an interrupted build is never trusted.
+    """
+    try:
+        built_digest = (dest_path / "source.sha256").read_text()
+    except FileNotFoundError:
+        return False
+    return built_digest == digest and (dest_path / render_batcher.main_output).exists()
 
 
-def build_all_songs():
+def build_song(song, force=False, dark_theme=True):
+    dest_path = Path("app/tmp/" + str(song.id))
+    output_path = dest_path / render_batcher.main_output
+    # SVG previews are scaled and themed by the browser
+    raster = settings.preview_format == "png"
+    source_lytex = song_source(song)
+    digest = source_hash(source_lytex)
+    if not force and is_built(dest_path, digest):
+        if raster and not all(
+            (dest_path / name).exists() for name in preview_names(dark_theme)
+        ):
+            derive_previews(dest_path, dark_theme)
+        return
+    requested = time.time()
+
+    def build():
+        dest_path.mkdir(parents=True, exist_ok=True)
+        manifest_path = dest_path / "source.sha256"
+        manifest_path.unlink(missing_ok=True)
+        for name in preview_names():
+            (dest_path / name).unlink(missing_ok=True)
+        if not render_batcher.submit(source_lytex, dest_path).result():
+            print(f"Couldn't build song {song.id}")
+            return None
+        manifest_path.write_text(digest)
+
+        if raster:
+            derive_previews(dest_path, dark_theme)
+        return output_path
+
+    def done():
+        # built by another worker while we were waiting for the lock
+        if is_built(dest_path, digest) and (
+            not force or output_path.stat().st_mtime >= requested
+        ):
+            return output_path
+        return None
+
+    return coordinator.run("song-" + str(song.id), build, done=done, version=digest)
+
+
+def build_all_songs(workers=None, force=False):
+    """Rebuild every song whose LilyPond source changed since its last build."""
     with db.get_session() as session:
-        songs = session.query(Song).all()
-        for song in songs:
-            if song.lytex:
-                build_song(song)
+        songs = session.exec(select(Song)).all()
+    build_songs(songs, workers, force)
+
+
+def build_songs(songs, workers=None, force=False, processes=True):
+    """
+    Rebuild the `songs` whose LilyPond source changed since their last build.
+
+    Up to `workers` songs are in flight at once, the render batcher compiles
+    them in shared lilypond runs. Every finished song is recorded in the build
+    manifest right away, so an interrupted run resumes where it stopped.
+    Previews are derived on a process pool, or on threads without `processes`.
+    """
+    workers = workers or settings.build_workers
+    songs = [song for song in songs if song.lytex]
+
+    pending = [
+        song
+        for song in songs
+        if force
+        or not is_built(Path("app/tmp/" + str(song.id)), source_hash(song_source(song)))
+    ]
+    print(f"{len(songs) - len(pending)} songs up to date, {len(pending)} to build")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(build_song, song, force, False): song for song in pending
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            song = futures[future]
+            try:
+                future.result()
+                print(f"[{done}/{len(pending)}] Built {song}")
+            except Exception as e:
+                print(f"[{done}/{len(pending)}] Couldn't build {song}: {e}")
+
+    # dark and scaled variants are derived from the built PNGs, convert the
+    # missing ones
+    if settings.preview_format != "png":
+        return
+    dest_paths = [Path("app/tmp/" + str(song.id)) for song in songs]
+    derive_all_previews(
+        [
+            dest_path
+            for dest_path in dest_paths
+            if (dest_path / "source.cropped.png").exists()
+            and not all((dest_path / name).exists() for name in preview_names())
+        ],
+        # threads share the server with requests, keep them to the build's
+        workers=None if processes else workers,
+        processes=processes,
+    )
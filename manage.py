@@ -1,7 +1,10 @@
 import argparse
 from getpass import getpass
 
+from app.artifacts import collect_garbage
+from app.songs.bulk import bulk_import
 from app.users.models import User as UserModel
+from app.utils import build_all_songs
 
 
 def create_superuser():
@@ -18,16 +21,68 @@ def create_superuser():
         print(f"Error creating superuser: {e}")
 
 
+def gc(quota_bytes=None, max_age=None):
+    """
+    Evict build artifacts from app/tmp over quota or age
+    """
+    reclaimed = collect_garbage(quota_bytes, max_age, verbose=True)
+    print(f"Reclaimed {reclaimed} bytes.")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Simple management for database")
 
     parser.add_argument(
         "--createsuperuser", action="store_true", help="Create a superuser"
     )
+    parser.add_argument(
+        "--gc", action="store_true", help="Evict build artifacts from app/tmp"
+    )
+    parser.add_argument(
+        "--quota", type=int, help="Byte quota for app/tmp, used with --gc"
+    )
+    parser.add_argument(
+        "--max-age", type=int, help="Maximum artifact age in seconds, used with --gc"
+    )
+    parser.add_argument(
+        "--build-songs",
+        action="store_true",
+        help="Build previews of songs whose LilyPond source changed",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Songs built at once, used with --build-songs"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rebuild everything, used with --build-songs",
+    )
+    parser.add_argument(
+        "--import-library", metavar="PATH", help="Import every song under PATH"
+    )
+    parser.add_argument(
+        "--batch-size", type=int, help="Songs per commit, used with --import-library"
+    )
+    parser.add_argument(
+        "--copy",
+        action="store_true",
+        help="Load new songs with PostgreSQL COPY, used with --import-library",
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help="Re-read unchanged song directories, used with --import-library",
+    )
     args = parser.parse_args()
 
     if args.createsuperuser:
         create_superuser()
+    if args.gc:
+        gc(args.quota, args.max_age)
+    if args.build_songs:
+        build_all_songs(args.workers, args.force)
+    if args.import_library:
+        bulk_import(args.import_library, args.batch_size, args.copy, full=args.full)
 
 
 if __name__ == "__main__":
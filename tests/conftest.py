@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# settings are read when app modules are imported, tests run on SQLite
+DATABASE_PATH = os.path.join(tempfile.mkdtemp(), "test.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{DATABASE_PATH}"
+os.environ.setdefault("SECRET_KEY", "test")
+os.environ.setdefault("REGISTER_ENABLED", "1")
@@ -0,0 +1,33 @@
+import shutil
+from types import SimpleNamespace
+
+import pytest
+
+from app.config import get_settings
+from app.press.book import book_environment
+from app.press.book import latex_escape
+from app.press.book import typeset
+
+TEMPLATES_DIR = get_settings().templates_dir
+SONGBOOK = SimpleNamespace(title="Rock & Roll 100% #1")
+
+
+def title_page(songbook):
+    template = book_environment(TEMPLATES_DIR).get_template("book.jinja2")
+    return template.render({"songbook": songbook})
+
+
+def test_latex_escape():
+    assert latex_escape("a & b_c 50% #1 $x$ {y}") == (r"a \& b\_c 50\% \#1 \$x\$ \{y\}")
+    assert latex_escape("~^\\") == (
+        r"\textasciitilde{}\textasciicircum{}\textbackslash{}"
+    )
+
+
+def test_title_is_escaped():
+    assert r"\title{ Rock \& Roll 100\% \#1 }" in title_page(SONGBOOK)
+
+
+@pytest.mark.skipif(shutil.which("pdflatex") is None, reason="needs pdflatex")
+def test_title_with_ampersand_typesets(tmp_path):
+    assert typeset(title_page(SONGBOOK), "title", tmp_path).exists()
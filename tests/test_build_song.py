@@ -0,0 +1,77 @@
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from pathlib import Path
+from types import SimpleNamespace
+
+from app import utils
+from app.press.coordinator import BuildCoordinator
+
+
+def test_overlapping_builds_of_other_content(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(utils, "coordinator", BuildCoordinator(tmp_path / "locks"))
+    monkeypatch.setattr(utils, "lilypond_version", lambda: "test")
+    monkeypatch.setattr(utils, "derive_previews", lambda *args: None)
+    started = threading.Event()
+    release = threading.Event()
+    compiled = []
+
+    def submit(source, dest_path, interactive=False):
+        compiled.append(source)
+        if len(compiled) == 1:
+            started.set()
+            release.wait(5)
+        (dest_path / utils.render_batcher.main_output).write_text(source)
+        future = Future()
+        future.set_result(True)
+        return future
+
+    monkeypatch.setattr(utils.render_batcher, "submit", submit)
+    song_id = uuid.uuid4()
+    old = SimpleNamespace(id=song_id, lytex="old")
+    new = SimpleNamespace(id=song_id, lytex="new")
+
+    first = threading.Thread(target=utils.build_song, args=(old,))
+    first.start()
+    assert started.wait(5)
+    second = threading.Thread(target=utils.build_song, args=(new,))
+    second.start()
+    # the new source arrives while the old one is compiling
+    time.sleep(0.2)
+    release.set()
+    first.join(5)
+    second.join(5)
+
+    assert compiled == [utils.song_source(old), utils.song_source(new)]
+    digest = utils.source_hash(utils.song_source(new))
+    assert utils.is_built(Path("app/tmp") / str(song_id), digest)
+
+
+def test_overlapping_builds_of_same_content_are_shared(tmp_path):
+    coordinator = BuildCoordinator(tmp_path / "locks")
+    release = threading.Event()
+    builds = []
+
+    def build():
+        builds.append(1)
+        release.wait(5)
+        return "artifact"
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(coordinator.run("key", build, version="a"))
+        )
+        for _ in range(2)
+    ]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.2)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert builds == [1]
+    assert results == ["artifact", "artifact"]
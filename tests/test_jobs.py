@@ -0,0 +1,47 @@
+import json
+import threading
+import time
+from types import SimpleNamespace
+
+from app.press import jobs
+from app.press.jobs import BuildJobs
+
+SONGBOOK = SimpleNamespace(songbook_id="1", title="Songbook")
+
+
+def test_job_of_a_lost_worker_is_failed(tmp_path):
+    build_jobs = BuildJobs(tmp_path, 1, heartbeat=1)
+    job = {"id": "b3c1f6b4-0f5e-4d8c-9a51-2f1d0a6e7c33", "status": "running"}
+    build_jobs.save(job)
+    assert build_jobs.get(job["id"])["status"] == "running"
+    job["updated"] = time.time() - 10
+    build_jobs.job_path(job["id"]).write_text(json.dumps(job))
+    assert build_jobs.get(job["id"])["status"] == "failed"
+    # the failure is recorded, not only reported
+    assert build_jobs.get(job["id"])["error"]
+
+
+def test_running_job_is_kept_fresh_and_shared(tmp_path, monkeypatch):
+    release = threading.Event()
+
+    def bake(songs, songbook, templates_dir, progress=None):
+        release.wait(5)
+        pdf_path = tmp_path / "book.pdf"
+        pdf_path.write_bytes(b"%PDF")
+        return pdf_path
+
+    monkeypatch.setattr(jobs, "bake", bake)
+    monkeypatch.setattr(jobs, "fingerprint", lambda *args: "digest")
+    monkeypatch.setattr(jobs, "songbook_path", lambda songbook: tmp_path / "books")
+    build_jobs = BuildJobs(tmp_path / "jobs", 1, heartbeat=0.1)
+
+    job = build_jobs.submit("user", [], SONGBOOK, tmp_path)
+    time.sleep(0.5)
+    assert build_jobs.get(job["id"])["status"] == "running"
+    # another worker reading the records finds the same job
+    other = BuildJobs(tmp_path / "jobs", 1, heartbeat=0.1)
+    assert other.submit("user", [], SONGBOOK, tmp_path)["id"] == job["id"]
+
+    release.set()
+    build_jobs.executor.shutdown(wait=True)
+    assert build_jobs.get(job["id"])["status"] == "done"
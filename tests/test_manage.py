@@ -0,0 +1,20 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_help(tmp_path):
+    # a fresh interpreter, so the import order of manage.py alone is tested
+    env = {**os.environ, "DATABASE_URL": f"sqlite:///{tmp_path / 'manage.db'}"}
+    result = subprocess.run(
+        [sys.executable, "manage.py", "--help"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    assert result.returncode == 0, result.stderr
+    assert "--import-library" in result.stdout
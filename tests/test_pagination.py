@@ -0,0 +1,65 @@
+import base64
+import json
+
+import pytest
+from sqlmodel import select
+
+from app import db
+from app.main import app  # noqa: F401, creates the tables
+from app.songs.models import Song
+from app.songs.models import Source
+from app.songs.pagination import decode_cursor
+from app.songs.pagination import keyset_page
+
+# (title, signature, number, page), in listing order
+SONGS = [
+    ("a", "A1", 1, 9),
+    ("b", "A1", 2, 1),
+    ("c", "A1", None, 0),
+    ("d", "B2", 1, 3),
+    ("e", "B2", 1, None),
+    ("f", None, 1, 1),
+    ("g", None, None, None),
+]
+
+
+def test_songs_are_listed_nulls_last_through_every_page():
+    with db.get_session() as session:
+        source = Source(title="Pagination source")
+        session.add(source)
+        session.commit()
+        for title, signature, number, page in reversed(SONGS):
+            session.add(
+                Song(
+                    title=title,
+                    signature=signature,
+                    number=number,
+                    page=page,
+                    source_id=source.id,
+                )
+            )
+        session.commit()
+
+        statement = select(Song).where(Song.source_id == source.id)
+        titles = []
+        cursor = None
+        while True:
+            songs, cursor = keyset_page(session, statement, cursor, size=2)
+            titles += [song.title for song in songs]
+            if cursor is None:
+                break
+    assert titles == [title for title, *_ in SONGS]
+
+
+@pytest.mark.parametrize(
+    "key",
+    [
+        ["a", 1, 1, 1],
+        [False, "A1", False, 1, False, 1, 1],
+        [False, "A1", False, "1", False, 1, "6f1d2c9e-4b7a-4e31-9a55-0c8e3f2b7d14"],
+    ],
+)
+def test_malformed_cursor(key):
+    cursor = base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
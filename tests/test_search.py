@@ -0,0 +1,48 @@
+import uuid
+
+from fastapi.testclient import TestClient
+
+from app import db
+from app.main import app
+from app.songs.models import Song
+from app.songs.models import Source
+
+
+def add_songs(*titles):
+    with db.get_session() as session:
+        source = Source(title=f"Source {uuid.uuid4()}", public=True)
+        session.add(source)
+        session.commit()
+        for number, title in enumerate(titles):
+            session.add(
+                Song(title=title, source_id=source.id, number=number, verses="la la")
+            )
+        session.commit()
+        return str(source.id)
+
+
+def test_search_without_search_indexes():
+    add_songs("Tancuj, tancuj", "Kopala studienku")
+    response = TestClient(app).get("/search", params={"q": "TANCUJ"})
+    assert response.status_code == 200
+    assert "Tancuj, tancuj" in response.text
+    assert "Kopala studienku" not in response.text
+
+
+def test_search_escapes_like_wildcards():
+    add_songs("100% pravda")
+    response = TestClient(app).get("/search/results", params={"q": "0%"})
+    assert response.status_code == 200
+    assert "100% pravda" in response.text
+    response = TestClient(app).get("/search/results", params={"q": "_"})
+    assert "100% pravda" not in response.text
+
+
+def test_source_title_filter_without_search_indexes():
+    source_id = add_songs("Na kameni", "Horela lipa")
+    response = TestClient(app).post(
+        "/source/filter", data={"source_id": source_id, "title": "lipa"}
+    )
+    assert response.status_code == 200
+    assert "Horela lipa" in response.text
+    assert "Na kameni" not in response.text
@@ -0,0 +1,36 @@
+import json
+import time
+
+from app.songs.watcher import ReimportQueue
+
+
+class StubQueue(ReimportQueue):
+    def reimport(self, paths, library_paths=()):
+        self.imported = (sorted(paths), sorted(library_paths))
+        # created, updated and skipped songs
+        return 0, 1, 0
+
+
+def test_only_song_directories_are_counted(tmp_path):
+    song_path = tmp_path / "folder" / "song"
+    song_path.mkdir(parents=True)
+    (song_path / "metadata.json").write_text(json.dumps({"id": "1"}))
+    source_path = tmp_path / "folder" / "source.json"
+    source_path.write_text("{}")
+
+    reimport_queue = StubQueue(tmp_path, 0.05, 1, 1)
+    reimport_queue.add(song_path / "metadata.json")
+    reimport_queue.add(source_path)
+    for _ in range(100):
+        if reimport_queue.stats()["batches"]:
+            break
+        time.sleep(0.05)
+
+    stats = reimport_queue.stats()
+    assert stats["processed"] == 1
+    assert stats["last_batch"]["size"] == 1
+    # the source folder is still passed on, its source.json is loaded
+    assert reimport_queue.imported == (
+        [tmp_path / "folder", song_path],
+        [source_path],
+    )